@@ -19,7 +19,7 @@ class ProductImageInline(admin.TabularInline):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'created_by', 'created_at', 'is_active')
+    list_display = ('name', 'category', 'price', 'created_by', 'created_at', 'is_active', 'popularity')
     list_filter = ('category', 'is_active', 'created_at')
     search_fields = ('name', 'description')
     inlines = [ProductImageInline]
@@ -73,17 +73,13 @@ class FavoriteAdmin(admin.ModelAdmin):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ('user', 'created_at', 'total_items', 'total_price')
+    list_display = ('user', 'created_at', 'item_count', 'total_price_display')
+    readonly_fields = ('item_count', 'total_price')
 
-    def total_items(self, obj):
-        return obj.total_items()
+    def total_price_display(self, obj):
+        return f"{obj.total_price} ₽"
 
-    total_items.short_description = 'Количество товаров'
-
-    def total_price(self, obj):
-        return f"{obj.total_price()} ₽"
-
-    total_price.short_description = 'Общая стоимость'
+    total_price_display.short_description = 'Общая стоимость'
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
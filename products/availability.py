@@ -0,0 +1,55 @@
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from .models import Product
+
+AVAILABILITY_TIMEOUT = 60 * 60 * 24
+
+# Всё, что страницы выводят о магазине рядом с товаром
+ShopEntry = namedtuple('ShopEntry', 'id name address phone opening_hours')
+
+
+def _cache_key(product_id):
+    return f'product_shops:{product_id}'
+
+
+def get_many(product_ids):
+    """Магазины товаров {product_id: [ShopEntry, ...]} из кэша; промахи — одним запросом по связям"""
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return {}
+
+    keys = {product_id: _cache_key(product_id) for product_id in product_ids}
+    cached = cache.get_many(list(keys.values()))
+    result = {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+
+    missed = [product_id for product_id in product_ids if product_id not in result]
+    if missed:
+        loaded = {product_id: [] for product_id in missed}
+        rows = Product.shops.through.objects.filter(product_id__in=missed).order_by('shop_id').values_list(
+            'product_id', 'shop_id', 'shop__name', 'shop__address', 'shop__phone', 'shop__opening_hours')
+        for product_id, *shop in rows:
+            loaded[product_id].append(ShopEntry(*shop))
+        cache.set_many({keys[product_id]: shops for product_id, shops in loaded.items()}, AVAILABILITY_TIMEOUT)
+        result.update(loaded)
+    return result
+
+
+def get_shops(product_id):
+    return get_many([product_id])[product_id]
+
+
+def attach(products):
+    """Проставляет товарам available_shops — шаблоны выводят магазины без запроса на каждый товар"""
+    products = list(products)
+    shops = get_many(product.id for product in products)
+    for product in products:
+        product.available_shops = shops[product.id]
+    return products
+
+
+def invalidate(product_ids):
+    product_ids = list(product_ids)
+    if product_ids:
+        cache.delete_many([_cache_key(product_id) for product_id in product_ids])
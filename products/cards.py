@@ -0,0 +1,57 @@
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import availability, versioning
+
+# Общая версия всех карточек: меняется при правке категорий и магазинов
+CARDS_VERSION_KEY = 'product_cards_version'
+
+# Время жизни фрагмента ограничивает и устаревание «N минут назад» в карточке
+CARD_TIMEOUT = 60 * 15
+
+
+def product_version_key(product_id):
+    return f'product_card_version:{product_id}'
+
+
+def invalidate_product(product_id):
+    versioning.bump(product_version_key(product_id))
+
+
+def invalidate_all():
+    versioning.bump(CARDS_VERSION_KEY)
+
+
+def render_cards(products, request):
+    """HTML карточек товаров из кэша фрагментов: [(товар, html), ...].
+
+    Промахи рендерятся пачкой после одной предзагрузки категорий и магазинов,
+    поэтому при попадании в кэш карточки не делают ни одного запроса к базе.
+    """
+    products = list(products)
+    if not products:
+        return []
+
+    common = versioning.get_version(CARDS_VERSION_KEY)
+    versions = versioning.get_versions([product_version_key(product.id) for product in products])
+    # Разметка карточки не зависит от пользователя — один фрагмент на всех
+    keys = {
+        product.id: f'product_card:{product.id}:{common}:{versions[product_version_key(product.id)]}'
+        for product in products
+    }
+
+    fragments = cache.get_many(list(keys.values()))
+    missed = [product for product in products if keys[product.id] not in fragments]
+    if missed:
+        prefetch_related_objects(missed, 'category')
+        availability.attach(missed)
+        rendered = {
+            keys[product.id]: render_to_string('products/product_card.html', {'product': product}, request=request)
+            for product in missed
+        }
+        cache.set_many(rendered, CARD_TIMEOUT)
+        fragments.update(rendered)
+
+    return [(product, mark_safe(fragments[keys[product.id]])) for product in products]
@@ -0,0 +1,201 @@
+from django.core import signing
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import popularity
+from .models import Cart, CartItem, Product
+
+# Ограничения пакетного изменения корзины
+MAX_BATCH_ITEMS = 200
+MAX_QUANTITY = 999
+# Верхняя граница id (BigAutoField) — большие числа база не примет
+MAX_PRODUCT_ID = 2 ** 63 - 1
+
+# Базы, где добавление в корзину делается одним INSERT ... ON CONFLICT DO UPDATE
+UPSERT_VENDORS = ('sqlite', 'postgresql')
+
+# Корзина гостя хранится в подписанной cookie вида "id:количество,id:количество"
+ANONYMOUS_COOKIE = 'cart'
+ANONYMOUS_SALT = 'products.cart.anonymous'
+ANONYMOUS_MAX_AGE = 60 * 60 * 24 * 30
+# Столько строк гарантированно помещается в cookie (4 КБ)
+MAX_ANONYMOUS_ITEMS = 100
+
+
+def get_cart(user):
+    cart, created = Cart.objects.get_or_create(user=user)
+    return cart
+
+
+def _upsert(cart_id, quantities):
+    """Один INSERT ... ON CONFLICT, прибавляющий количества к существующим строкам.
+
+    Возвращает id товаров, для которых строка вставлена, а не обновлена: у них
+    итоговое количество равно добавленному.
+    """
+    table = CartItem._meta.db_table
+    now = timezone.now()
+    rows = ', '.join(['(%s, %s, %s, %s)'] * len(quantities))
+    params = []
+    for product_id, quantity in quantities.items():
+        params += [cart_id, product_id, quantity, now]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (cart_id, product_id, quantity, added_at) VALUES {rows} '
+            f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity '
+            f'RETURNING product_id, quantity',
+            params
+        )
+        return [product_id for product_id, quantity in cursor.fetchall() if quantity == quantities[product_id]]
+
+
+def _increment(cart_id, product_id, quantity):
+    """Для прочих баз: атомарный UPDATE с F(), а при отсутствии строки — INSERT"""
+    lines = CartItem.objects.filter(cart_id=cart_id, product_id=product_id)
+    if lines.update(quantity=F('quantity') + quantity):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+    except IntegrityError:
+        # Строку успел вставить параллельный запрос — уникальность (cart, product) гарантирует одну
+        lines.update(quantity=F('quantity') + quantity)
+
+
+def add_items(cart, quantities):
+    """Прибавляет количества {product_id: quantity} без чтения строк: параллельные добавления не теряются"""
+    if not quantities:
+        return
+    with transaction.atomic():
+        if connection.vendor in UPSERT_VENDORS:
+            popularity.change(_upsert(cart.pk, quantities), popularity.CARTS, 1)
+        else:
+            # Строки, созданные через ORM, учитывает сигнал post_save
+            for product_id, quantity in quantities.items():
+                _increment(cart.pk, product_id, quantity)
+        # Запрос в обход ORM не вызывает сигналы, итоги пересчитываем сами
+        Cart.objects.filter(pk=cart.pk).refresh_totals()
+
+
+def add_item(cart, product_id, quantity=1):
+    add_items(cart, {product_id: quantity})
+
+
+def remove_item(cart, product_id):
+    """Удаляет строку корзины, возвращает True, если она была; итоги пересчитывает сигнал post_delete"""
+    with transaction.atomic():
+        deleted, _ = CartItem.objects.filter(cart=cart, product_id=product_id).delete()
+    return bool(deleted)
+
+
+def _delete_lines(cart_id, product_ids):
+    """Один DELETE в обход ORM: QuerySet.delete() выбрал бы строки и отправил post_delete на каждую"""
+    table = CartItem._meta.db_table
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE cart_id = %s AND product_id IN ({placeholders})',
+            [cart_id, *product_ids]
+        )
+
+
+def set_quantities(cart, quantities):
+    """Устанавливает количества сразу для многих товаров: {product_id: quantity}, 0 — удалить.
+
+    Новые и изменённые строки записываются одним bulk_create с обновлением при
+    конфликте (cart, product), удаление — одним DELETE; всё в одной транзакции.
+    Ни то ни другое не вызывает сигналы, поэтому популярность и итоги корзины
+    пересчитываются здесь же по одному разу на весь пакет.
+    """
+    lines = [
+        CartItem(cart=cart, product_id=product_id, quantity=quantity)
+        for product_id, quantity in quantities.items() if quantity > 0
+    ]
+    with transaction.atomic():
+        existing = set(cart.items.filter(product_id__in=list(quantities)).values_list('product_id', flat=True))
+        if lines:
+            CartItem.objects.bulk_create(
+                lines, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity']
+            )
+            popularity.change([line.product_id for line in lines if line.product_id not in existing],
+                              popularity.CARTS, 1)
+        removed = [product_id for product_id, quantity in quantities.items()
+                   if quantity <= 0 and product_id in existing]
+        if removed:
+            # Без выборки строк и post_delete на каждую: один DELETE
+            _delete_lines(cart.pk, removed)
+            popularity.change(removed, popularity.CARTS, -1)
+        cart.refresh_totals()
+    return cart
+
+
+# Корзина гостя
+
+def read_anonymous(request):
+    """Содержимое корзины гостя {product_id: quantity}; битая или поддельная cookie — пустая корзина"""
+    try:
+        value = request.get_signed_cookie(ANONYMOUS_COOKIE, salt=ANONYMOUS_SALT, max_age=ANONYMOUS_MAX_AGE)
+    except (KeyError, signing.BadSignature):
+        return {}
+    quantities = {}
+    for pair in value.split(','):
+        try:
+            product_id, quantity = map(int, pair.split(':'))
+        except ValueError:
+            continue
+        if product_id > 0 and 0 < quantity <= MAX_QUANTITY:
+            quantities[product_id] = quantity
+    return dict(list(quantities.items())[:MAX_ANONYMOUS_ITEMS])
+
+
+def save_anonymous(response, quantities):
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        response.delete_cookie(ANONYMOUS_COOKIE)
+        return
+    value = ','.join(f'{product_id}:{quantity}' for product_id, quantity in quantities.items())
+    response.set_signed_cookie(
+        ANONYMOUS_COOKIE, value, salt=ANONYMOUS_SALT, max_age=ANONYMOUS_MAX_AGE, httponly=True, samesite='Lax'
+    )
+
+
+class AnonymousCart:
+    """Корзина гостя с тем же интерфейсом для шаблонов, что и Cart; цены — одним запросом id__in"""
+
+    def __init__(self, quantities):
+        products = Product.objects.filter(id__in=quantities, is_active=True).in_bulk()
+        self.lines = [
+            CartItem(product=products[product_id], quantity=quantity)
+            for product_id, quantity in quantities.items() if product_id in products
+        ]
+        self.item_count = sum(line.quantity for line in self.lines)
+        self.total_price = sum((line.total_price() for line in self.lines), 0)
+
+    def total_items(self):
+        return self.item_count
+
+
+def merge_anonymous(request, user):
+    """Переносит корзину гостя в корзину пользователя одним upsert; cookie удаляет AnonymousCartMiddleware"""
+    quantities = read_anonymous(request)
+    if not quantities:
+        return
+    available = set(Product.objects.filter(id__in=quantities, is_active=True).values_list('id', flat=True))
+    add_items(get_cart(user), {
+        product_id: quantity for product_id, quantity in quantities.items() if product_id in available
+    })
+    request.anonymous_cart_merged = True
+
+
+class AnonymousCartMiddleware:
+    """Удаляет cookie корзины гостя после её переноса в корзину пользователя"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, 'anonymous_cart_merged', False):
+            response.delete_cookie(ANONYMOUS_COOKIE)
+        return response
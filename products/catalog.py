@@ -0,0 +1,90 @@
+import math
+
+from django.db.models import Case, FloatField, OuterRef, Subquery, Value, When
+
+from . import geo, hierarchy, search
+from .models import Product
+
+FILTER_PARAMS = ('q', 'category', 'shop', 'price_min', 'price_max', 'lat', 'lng', 'radius')
+
+# Радиус «в наличии рядом» по умолчанию и максимальный, км
+NEAR_DEFAULT_RADIUS_KM = 5
+NEAR_MAX_RADIUS_KM = 200
+
+
+def get_filters(params):
+    """Фильтры каталога из GET-параметров"""
+    filters = {name: params.get(name, '') for name in FILTER_PARAMS}
+
+    # Координаты округляются до ~10 м, чтобы соседние точки делили кэш фасетов
+    point = geo.parse_point(filters['lat'], filters['lng'])
+    if point:
+        try:
+            radius = float(filters['radius'])
+        except ValueError:
+            radius = NEAR_DEFAULT_RADIUS_KM
+        if not math.isfinite(radius):
+            radius = NEAR_DEFAULT_RADIUS_KM
+        radius = min(max(radius, 0.1), NEAR_MAX_RADIUS_KM)
+        filters.update(lat=f'{point[0]:.4f}', lng=f'{point[1]:.4f}', radius=f'{radius:g}')
+    else:
+        filters.update(lat='', lng='', radius='')
+    return filters
+
+
+def has_location(filters):
+    return bool(filters['lat'])
+
+
+def _nearby_shops(filters):
+    return geo.nearby_shops(float(filters['lat']), float(filters['lng']), float(filters['radius']))
+
+
+def annotate_shop_distance(products, filters):
+    """Добавляет nearest_shop_km — расстояние до ближайшего магазина рядом, где есть товар"""
+    nearby = _nearby_shops(filters)
+    if not nearby:
+        return products.annotate(nearest_shop_km=Value(None, output_field=FloatField()))
+    distance = Case(
+        *[When(shop_id=shop_id, then=Value(km)) for shop_id, km in nearby.items()],
+        output_field=FloatField(),
+    )
+    nearest = (
+        Product.shops.through.objects
+        .filter(product_id=OuterRef('pk'), shop_id__in=list(nearby))
+        .annotate(distance=distance).order_by('distance').values('distance')[:1]
+    )
+    return products.annotate(nearest_shop_km=Subquery(nearest, output_field=FloatField()))
+
+
+def filter_products(filters, skip=(), with_rank=False):
+    """Активные товары с применёнными фильтрами, кроме перечисленных в skip"""
+    products = Product.objects.filter(is_active=True)
+
+    # ФИЛЬТРАЦИЯ ПО КАТЕГОРИИ С ИЕРАРХИЕЙ
+    if filters['category'] and 'category' not in skip:
+        products = products.filter(category_id__in=hierarchy.subtree_ids(int(filters['category'])))
+
+    # Фильтрация по магазину
+    if filters['shop'] and 'shop' not in skip:
+        products = products.filter(shops__id=filters['shop'])
+
+    # В наличии рядом: магазины в радиусе из геоиндекса, товары — через связь с магазинами
+    if has_location(filters) and 'near' not in skip:
+        nearby = _nearby_shops(filters)
+        products = products.filter(id__in=Product.shops.through.objects.filter(
+            shop_id__in=list(nearby)
+        ).values('product_id'))
+
+    # Фильтрация по цене
+    if 'price' not in skip:
+        if filters['price_min']:
+            products = products.filter(price__gte=filters['price_min'])
+        if filters['price_max']:
+            products = products.filter(price__lte=filters['price_max'])
+
+    # ПОЛНОТЕКСТОВЫЙ ПОИСК С РУССКОЙ МОРФОЛОГИЕЙ
+    if filters['q']:
+        products = search.search_products(products, filters['q'], with_rank=with_rank)
+
+    return products
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Кэши, которые не видны другим процессам сервера
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def shared_cache_check(app_configs, **kwargs):
+    """Версии в кэше должны быть общими для всех процессов, иначе снимки в памяти не сбрасываются"""
+    warnings = []
+    for alias, options in settings.CACHES.items():
+        backend = options.get('BACKEND', '')
+        if backend not in PROCESS_LOCAL_CACHES:
+            continue
+        warnings.append(Warning(
+            f'Кэш {alias!r} ({backend}) не общий для процессов сервера',
+            hint='Изменения категорий, магазинов и избранного увидит только процесс, который их сделал. '
+                 'Настройте DatabaseCache (manage.py createcachetable) или Redis в CACHES.',
+            id='products.W001',
+        ))
+    return warnings
@@ -0,0 +1,8 @@
+from . import cart
+
+
+def cart_count(request):
+    """Количество товаров в корзине гостя для значка в шапке (без запросов к базе)"""
+    if getattr(request, 'user', None) is None or request.user.is_authenticated:
+        return {}
+    return {'anonymous_cart_count': sum(cart.read_anonymous(request).values())}
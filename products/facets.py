@@ -0,0 +1,94 @@
+import hashlib
+import json
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from . import hierarchy, versioning
+from .catalog import filter_products
+from .models import Product
+
+# Границы ценовых диапазонов: [от, до)
+PRICE_BUCKETS = [
+    (None, Decimal('100')),
+    (Decimal('100'), Decimal('500')),
+    (Decimal('500'), Decimal('1000')),
+    (Decimal('1000'), Decimal('5000')),
+    (Decimal('5000'), None),
+]
+
+FACETS_TIMEOUT = 300
+
+
+def _cache_key(filters):
+    signature = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+    return f'facets:{versioning.get_version(versioning.CATALOG_VERSION_KEY)}:{signature}'
+
+
+def _bucket_q(low, high):
+    q = Q()
+    if low is not None:
+        q &= Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
+
+def compute_facets(filters):
+    """Счётчики товаров по веткам категорий, магазинам и ценам — по одному групповому запросу на фасет.
+
+    Для каждого фасета учитываются все фильтры, кроме его собственного,
+    чтобы показывать, сколько товаров будет при выборе другого значения.
+    """
+    # Категории: группировка по category_id и подъём счётчиков к предкам
+    tree = hierarchy.get_snapshot()
+    categories = defaultdict(int)
+    rows = filter_products(filters, skip=('category',)).order_by().values_list('category_id').annotate(n=Count('id'))
+    for category_id, count in rows:
+        for ancestor_id in tree.ancestor_ids(category_id):
+            categories[ancestor_id] += count
+
+    # Магазины: группировка по промежуточной таблице M2M
+    products = filter_products(filters, skip=('shop',)).order_by()
+    shops = dict(
+        Product.shops.through.objects
+        .filter(product_id__in=products.values('id'))
+        .order_by().values_list('shop_id').annotate(n=Count('product_id'))
+    )
+
+    # Цены: все диапазоны одним агрегатом
+    totals = filter_products(filters, skip=('price',)).aggregate(**{
+        f'bucket_{i}': Count('id', filter=_bucket_q(low, high))
+        for i, (low, high) in enumerate(PRICE_BUCKETS)
+    })
+    prices = [totals[f'bucket_{i}'] for i in range(len(PRICE_BUCKETS))]
+
+    return {'categories': dict(categories), 'shops': shops, 'prices': prices}
+
+
+def get_facets(filters):
+    """Счётчики фасетов из кэша по сигнатуре фильтров"""
+    key = _cache_key(filters)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
+
+
+def price_ranges(counts):
+    """Ценовые диапазоны для шаблона: границы, подпись и количество товаров"""
+    ranges = []
+    for (low, high), count in zip(PRICE_BUCKETS, counts):
+        if low is None:
+            label = f'до {high}'
+        elif high is None:
+            label = f'от {low}'
+        else:
+            label = f'{low} – {high}'
+        # Фильтр price_max включает границу, а диапазон — нет
+        price_max = high - Decimal('0.01') if high is not None else ''
+        ranges.append({'min': low or '', 'max': price_max, 'label': f'{label} ₽', 'count': count})
+    return ranges
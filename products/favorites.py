@@ -0,0 +1,67 @@
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+
+from .models import Favorite
+
+FAVORITES_TIMEOUT = 60 * 60 * 24
+
+
+def _cache_key(user_id):
+    return f'favorites:{user_id}'
+
+
+class FavoriteIds:
+    """Отсортированный массив id избранных товаров; проверка «в избранном» — двоичный поиск"""
+
+    def __init__(self, ids=()):
+        self.ids = array('q', sorted(set(ids)))
+
+    @classmethod
+    def from_bytes(cls, data):
+        favorite_ids = cls()
+        favorite_ids.ids.frombytes(data)
+        return favorite_ids
+
+    def to_bytes(self):
+        return self.ids.tobytes()
+
+    def __contains__(self, product_id):
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return False
+        position = bisect_left(self.ids, product_id)
+        return position < len(self.ids) and self.ids[position] == product_id
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _load(user_id):
+    favorite_ids = FavoriteIds(Favorite.objects.filter(user_id=user_id).values_list('product_id', flat=True))
+    cache.set(_cache_key(user_id), favorite_ids.to_bytes(), FAVORITES_TIMEOUT)
+    return favorite_ids
+
+
+def get_ids(user):
+    """Избранное пользователя из кэша; запрос к базе — только при промахе"""
+    if not user.is_authenticated:
+        return FavoriteIds()
+    data = cache.get(_cache_key(user.pk))
+    if data is None:
+        return _load(user.pk)
+    return FavoriteIds.from_bytes(data)
+
+
+def invalidate(user_id):
+    """Сбрасывает закэшированный набор: следующее чтение загрузит его одним запросом.
+
+    Правка набора на месте (прочитать, изменить, записать) без блокировки теряла бы
+    одно из двух параллельных изменений.
+    """
+    cache.delete(_cache_key(user_id))
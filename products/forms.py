@@ -1,5 +1,6 @@
 from django import forms
-from .models import Product, Category, ProductImage, Shop
+from .models import Product, ProductImage, Shop
+from . import hierarchy
 
 
 class ShopForm(forms.ModelForm):
@@ -27,22 +28,8 @@ class ProductForm(forms.ModelForm):
         else:
             self.fields['shops'].queryset = Shop.objects.all()
 
-        # Иерархия категорий
-        def get_category_choices():
-            choices = [('', '---------')]
-
-            def add_categories(categories, level=0):
-                for category in categories:
-                    indent = "--- " * level
-                    choices.append((category.id, f"{indent}{category.name}"))
-                    children = Category.objects.filter(parent=category)
-                    add_categories(children, level + 1)
-
-            root_categories = Category.objects.filter(parent__isnull=True)
-            add_categories(root_categories)
-            return choices
-
-        self.fields['category'].choices = get_category_choices()
+        # Иерархия категорий (одним запросом)
+        self.fields['category'].choices = hierarchy.get_choices()
 
     # ДОБАВЛЕН ЭТОТ МЕТОД ДЛЯ СОХРАНЕНИЯ MANYTOMANY
     def save(self, commit=True):
@@ -0,0 +1,105 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Count, Max
+from PIL import Image, ImageOps
+
+from . import signals, thumbnails
+from .models import ProductImage
+
+MAX_GALLERY_IMAGES = 6
+# Потоков на один запрос: декодирование и запись на диск отпускают GIL
+GALLERY_WORKERS = 4
+
+# Эти форматы сохраняются как есть (без EXIF), остальные перекодируются в PNG
+KEPT_FORMATS = {
+    'JPEG': ('jpg', {'quality': 90, 'optimize': True}),
+    'WEBP': ('webp', {'quality': 90}),
+}
+DEFAULT_FORMAT = ('PNG', 'png', {'optimize': True})
+
+
+class GalleryError(ValueError):
+    pass
+
+
+def _decode(upload):
+    """Проверяет файл и декодирует его, повернув по EXIF; битые и не-изображения отклоняются"""
+    try:
+        Image.open(upload).verify()
+        upload.seek(0)
+        image = Image.open(upload)
+        image_format = image.format
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except Image.DecompressionBombError:
+        raise GalleryError('изображение слишком большое')
+    except (OSError, SyntaxError, ValueError):
+        raise GalleryError('файл не является изображением или повреждён')
+    return image, image_format
+
+
+def _encode(image, image_format):
+    """Перекодирует изображение: метаданные (EXIF с геопозицией и т.п.) в файл не попадают"""
+    if image_format in KEPT_FORMATS:
+        extension, options = KEPT_FORMATS[image_format]
+    else:
+        image_format, extension, options = DEFAULT_FORMAT
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return extension, ContentFile(buffer.getvalue())
+
+
+def _prepare(product, upload):
+    """Обработка одного файла в потоке пула: без обращений к базе, только файлы"""
+    image, image_format = _decode(upload)
+    product_image = ProductImage(product=product)
+    field = product_image.image.field
+    try:
+        extension, content = _encode(image, image_format)
+        stem, _ = os.path.splitext(os.path.basename(upload.name))
+        name = field.generate_filename(product_image, f'{stem}.{extension}')
+        product_image.image = field.storage.save(name, content)
+    except OSError:
+        raise GalleryError('не удалось сохранить изображение')
+    product_image.thumbnails = thumbnails.build(product_image.image, image)
+    return product_image
+
+
+def add_images(product, uploads):
+    """Добавляет файлы в галерею товара: обработка параллельно, запись в базу — одним bulk_create.
+
+    Возвращает (созданные ProductImage, ошибки [(имя файла, причина)]). Файлы сверх
+    MAX_GALLERY_IMAGES с учётом уже загруженных не обрабатываются и попадают в ошибки.
+    """
+    if not uploads:
+        return [], []
+
+    existing = product.images.aggregate(count=Count('pk'), last=Max('order'))
+    free = max(MAX_GALLERY_IMAGES - existing['count'], 0)
+    uploads, skipped = uploads[:free], uploads[free:]
+
+    prepared, errors = [], []
+    with ThreadPoolExecutor(max_workers=max(min(GALLERY_WORKERS, len(uploads)), 1)) as executor:
+        futures = [(upload, executor.submit(_prepare, product, upload)) for upload in uploads]
+        for upload, future in futures:
+            try:
+                prepared.append(future.result())
+            except GalleryError as error:
+                errors.append((upload.name, str(error)))
+    errors += [(upload.name, f'в галерее не больше {MAX_GALLERY_IMAGES} фото') for upload in skipped]
+
+    # Порядок — как в форме загрузки, после уже существующих фото
+    for position, product_image in enumerate(prepared, start=(existing['last'] or 0) + 1):
+        product_image.order = position
+    with transaction.atomic():
+        created = ProductImage.objects.bulk_create(prepared)
+        if created:
+            # bulk_create не вызывает post_save — кэши сбрасываем сами
+            signals.gallery_changed(product.pk)
+    return created, errors
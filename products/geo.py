@@ -0,0 +1,271 @@
+import heapq
+import math
+import threading
+
+from django.core.cache import cache
+
+from . import versioning
+from .models import Shop
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Версия геоиндекса магазинов: меняется при любом изменении магазинов
+SHOPS_VERSION_KEY = 'shop_geo_version'
+
+# Кандидаты «магазины рядом» кэшируются по ячейкам сетки (≈5 км по широте)
+NEARBY_CELL_DEGREES = 0.05
+NEARBY_TIMEOUT = 60 * 10
+MAX_NEARBY_SHOPS = 500
+
+# Кластеры карты: сетка в проекции Меркатора с ячейкой CLUSTER_CELL_PIXELS на каждом
+# масштабе до MAX_CLUSTER_ZOOM; крупнее — магазины выводятся по одному
+MAX_CLUSTER_ZOOM = 16
+CLUSTER_CELL_PIXELS = 64
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Расстояние по поверхности Земли в километрах"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_point(lat, lng):
+    """(широта, долгота) из параметров запроса или None, если они не заданы или некорректны"""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def _unit_vector(lat, lng):
+    lat, lng = math.radians(lat), math.radians(lng)
+    return math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat)
+
+
+def _chord_squared(km):
+    """Квадрат хорды единичной сферы для расстояния по поверхности: порядок у них совпадает"""
+    return (2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)) ** 2
+
+
+def _build(points, depth=0):
+    """k-d дерево по точкам на единичной сфере: (точка, id, ось, левое, правое)"""
+    if not points:
+        return None
+    axis = depth % 3
+    points.sort(key=lambda item: item[0][axis])
+    middle = len(points) // 2
+    point, shop_id = points[middle]
+    return point, shop_id, axis, _build(points[:middle], depth + 1), _build(points[middle + 1:], depth + 1)
+
+
+def _mercator(lat, lng):
+    """Координаты точки в долях мира (0..1) в проекции Меркатора"""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    sin_lat = math.sin(math.radians(lat))
+    x = (lng + 180) / 360
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def _cells_per_side(zoom):
+    return (256 << zoom) // CLUSTER_CELL_PIXELS
+
+
+def _cell(x, y, cells):
+    return min(int(x * cells), cells - 1), min(int(y * cells), cells - 1)
+
+
+class ClusterGrid:
+    """Предрасчитанные кластеры по масштабам: {масштаб: {ячейка: [количество, Σширот, Σдолгот, id]}}"""
+
+    def __init__(self, coordinates):
+        self.levels = {}
+        projected = [(shop_id, lat, lng, _mercator(lat, lng)) for shop_id, (lat, lng) in coordinates.items()]
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            cells = _cells_per_side(zoom)
+            level = {}
+            for shop_id, lat, lng, (x, y) in projected:
+                cell = level.setdefault(_cell(x, y, cells), [0, 0.0, 0.0, shop_id])
+                cell[0] += 1
+                cell[1] += lat
+                cell[2] += lng
+            self.levels[zoom] = level
+
+    def _visible_cells(self, level, cells, x_ranges, y_range):
+        """Ячейки в видимой области: перебор диапазона или всех непустых — что короче"""
+        area = sum(x_end - x_start + 1 for x_start, x_end in x_ranges) * (y_range[1] - y_range[0] + 1)
+        if area <= len(level):
+            for x_start, x_end in x_ranges:
+                for cx in range(x_start, x_end + 1):
+                    for cy in range(y_range[0], y_range[1] + 1):
+                        if (cx, cy) in level:
+                            yield level[(cx, cy)]
+        else:
+            for (cx, cy), cell in level.items():
+                if y_range[0] <= cy <= y_range[1] and any(start <= cx <= end for start, end in x_ranges):
+                    yield cell
+
+    def query(self, south, west, north, east, zoom):
+        """Кластеры [(количество, широта центроида, долгота центроида)] и id одиночных магазинов в области"""
+        level = self.levels[zoom]
+        cells = _cells_per_side(zoom)
+        _, y_top = _mercator(north, 0)
+        _, y_bottom = _mercator(south, 0)
+        y_range = (_cell(0, y_top, cells)[1], _cell(0, y_bottom, cells)[1])
+        x_west, _ = _mercator(0, west)
+        x_east, _ = _mercator(0, east)
+        # Область через антимеридиан делится на две
+        if west <= east:
+            x_ranges = [(_cell(x_west, 0, cells)[0], _cell(x_east, 0, cells)[0])]
+        else:
+            x_ranges = [(_cell(x_west, 0, cells)[0], cells - 1), (0, _cell(x_east, 0, cells)[0])]
+
+        clusters, singles = [], []
+        for count, lat_sum, lng_sum, shop_id in self._visible_cells(level, cells, x_ranges, y_range):
+            if count == 1:
+                singles.append(shop_id)
+            else:
+                clusters.append((count, lat_sum / count, lng_sum / count))
+        return clusters, singles
+
+
+class ShopGeoIndex:
+    """Пространственный индекс магазинов с координатами в памяти процесса"""
+
+    def __init__(self, rows):
+        self.coordinates = {shop_id: (lat, lng) for shop_id, lat, lng in rows}
+        self.root = _build([(_unit_vector(lat, lng), shop_id) for shop_id, (lat, lng) in self.coordinates.items()])
+        self._clusters = None
+        self._clusters_lock = threading.Lock()
+
+    @property
+    def clusters(self):
+        """Сетка кластеров строится при первом обращении к карте"""
+        if self._clusters is None:
+            with self._clusters_lock:
+                if self._clusters is None:
+                    self._clusters = ClusterGrid(self.coordinates)
+        return self._clusters
+
+    def in_box(self, south, west, north, east):
+        """id магазинов внутри прямоугольника (для масштабов крупнее MAX_CLUSTER_ZOOM)"""
+        crosses = west > east
+        return [
+            shop_id for shop_id, (lat, lng) in self.coordinates.items()
+            if south <= lat <= north and ((west <= lng or lng <= east) if crosses else west <= lng <= east)
+        ]
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def nearest(self, lat, lng, limit=None, radius_km=None):
+        """Ближайшие магазины [(id, расстояние в км)] по возрастанию расстояния.
+
+        limit ограничивает количество (top-k), radius_km — расстояние; можно задать оба.
+        """
+        target = _unit_vector(lat, lng)
+        max_distance = _chord_squared(radius_km) if radius_km is not None else math.inf
+        found = []  # куча (-квадрат хорды, id) из не более чем limit ближайших
+
+        def bound():
+            if limit is not None and len(found) >= limit:
+                return min(max_distance, -found[0][0])
+            return max_distance
+
+        def search(node):
+            if node is None:
+                return
+            point, shop_id, axis, left, right = node
+            distance = sum((a - b) ** 2 for a, b in zip(point, target))
+            if distance <= bound():
+                heapq.heappush(found, (-distance, shop_id))
+                if limit is not None and len(found) > limit:
+                    heapq.heappop(found)
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            search(near)
+            if diff * diff <= bound():
+                search(far)
+
+        if limit != 0:
+            search(self.root)
+        return sorted(
+            ((shop_id, haversine(lat, lng, *self.coordinates[shop_id])) for _, shop_id in found),
+            key=lambda item: item[1],
+        )
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_index():
+    """Геоиндекс магазинов из памяти процесса, перестраиваемый после изменений магазинов"""
+    global _snapshot
+    version = versioning.get_version(SHOPS_VERSION_KEY)
+    snapshot = _snapshot
+    if snapshot is None or snapshot[0] != version:
+        with _snapshot_lock:
+            snapshot = _snapshot
+            if snapshot is None or snapshot[0] != version:
+                rows = Shop.objects.filter(latitude__isnull=False, longitude__isnull=False).values_list(
+                    'id', 'latitude', 'longitude')
+                snapshot = (version, ShopGeoIndex(rows))
+                _snapshot = snapshot
+    return snapshot[1]
+
+
+def invalidate():
+    versioning.bump(SHOPS_VERSION_KEY)
+
+
+def nearest_shops(lat, lng, limit=None, radius_km=None):
+    return get_index().nearest(lat, lng, limit=limit, radius_km=radius_km)
+
+
+def _cell_bounds(lat, lng):
+    """Ячейка сетки, в которую попадает точка: (южная широта, западная долгота)"""
+    return (math.floor(lat / NEARBY_CELL_DEGREES) * NEARBY_CELL_DEGREES,
+            math.floor(lng / NEARBY_CELL_DEGREES) * NEARBY_CELL_DEGREES)
+
+
+def nearby_shops(lat, lng, radius_km):
+    """{id магазина: расстояние в км} для магазинов в радиусе от точки, не больше MAX_NEARBY_SHOPS ближайших.
+
+    Кандидаты ищутся от центра ячейки с запасом на её полудиагональ и кэшируются
+    для всей ячейки; точные расстояния до пользователя досчитываются по индексу.
+    """
+    south, west = _cell_bounds(lat, lng)
+    center = (min(south + NEARBY_CELL_DEGREES / 2, 90.0), west + NEARBY_CELL_DEGREES / 2)
+    slack = max(haversine(*center, corner_lat, corner_lng)
+                for corner_lat in (south, min(south + NEARBY_CELL_DEGREES, 90.0))
+                for corner_lng in (west, west + NEARBY_CELL_DEGREES))
+
+    version = versioning.get_version(SHOPS_VERSION_KEY)
+    key = f'nearby_shops:{version}:{south:.2f}:{west:.2f}:{radius_km:g}'
+    candidates = cache.get(key)
+    index = get_index()
+    if candidates is None:
+        candidates = [shop_id for shop_id, distance in index.nearest(*center, radius_km=radius_km + slack)]
+        cache.set(key, candidates, NEARBY_TIMEOUT)
+
+    distances = []
+    for shop_id in candidates:
+        if shop_id in index.coordinates:
+            distance = haversine(lat, lng, *index.coordinates[shop_id])
+            if distance <= radius_km:
+                distances.append((distance, shop_id))
+    return {shop_id: distance for distance, shop_id in sorted(distances)[:MAX_NEARBY_SHOPS]}
+
+
+def map_markers(south, west, north, east, zoom):
+    """Кластеры и одиночные магазины для видимой области карты"""
+    index = get_index()
+    if zoom > MAX_CLUSTER_ZOOM:
+        return [], index.in_box(south, west, north, east)
+    return index.clusters.query(south, west, north, east, zoom)
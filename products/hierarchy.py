@@ -0,0 +1,150 @@
+import threading
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+
+from . import versioning
+from .models import Category, CategoryClosure
+
+
+def closure_rows(pairs):
+    """Строит строки closure table (предок, потомок, глубина) по парам (id, parent_id)"""
+    parents = dict(pairs)
+    rows = []
+    for category_id in parents:
+        ancestor_id, depth = category_id, 0
+        seen = set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append((ancestor_id, category_id, depth))
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+    return rows
+
+
+def rebuild():
+    """Полностью пересобирает индекс иерархии по текущим категориям"""
+    pairs = Category.objects.order_by().values_list('id', 'parent_id')
+    CategoryClosure.objects.all().delete()
+    CategoryClosure.objects.bulk_create([
+        CategoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth)
+        for ancestor_id, descendant_id, depth in closure_rows(pairs)
+    ], batch_size=1000)
+
+
+def insert_node(category):
+    """Добавляет новую категорию в индекс: ссылка на себя + все предки родителя"""
+    rows = [CategoryClosure(ancestor_id=category.pk, descendant_id=category.pk, depth=0)]
+    if category.parent_id:
+        ancestors = CategoryClosure.objects.filter(descendant_id=category.parent_id).values_list('ancestor_id', 'depth')
+        rows += [
+            CategoryClosure(ancestor_id=ancestor_id, descendant_id=category.pk, depth=depth + 1)
+            for ancestor_id, depth in ancestors
+        ]
+    CategoryClosure.objects.bulk_create(rows)
+
+
+def move_node(category):
+    """Переносит ветку категории под нового родителя"""
+    subtree = list(CategoryClosure.objects.filter(ancestor_id=category.pk).values_list('descendant_id', 'depth'))
+    subtree_ids = [descendant_id for descendant_id, _ in subtree]
+
+    if category.parent_id in subtree_ids:
+        raise ValidationError('Категория не может быть вложена в свою подкатегорию')
+
+    # Отрываем ветку от старых предков
+    CategoryClosure.objects.filter(
+        descendant_id__in=subtree_ids
+    ).exclude(ancestor_id__in=subtree_ids).delete()
+
+    # Подвешиваем ветку ко всем предкам нового родителя
+    if category.parent_id:
+        ancestors = CategoryClosure.objects.filter(descendant_id=category.parent_id).values_list('ancestor_id', 'depth')
+        CategoryClosure.objects.bulk_create([
+            CategoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=up + down + 1)
+            for ancestor_id, up in ancestors
+            for descendant_id, down in subtree
+        ], batch_size=1000)
+
+
+def subtree_ids(category_id):
+    """Подзапрос с id категории и всех её подкатегорий"""
+    return CategoryClosure.objects.filter(ancestor_id=category_id).values('descendant_id')
+
+
+def is_descendant(category_id, ancestor_id):
+    """Проверяет, лежит ли категория в ветке ancestor_id"""
+    return CategoryClosure.objects.filter(ancestor_id=ancestor_id, descendant_id=category_id).exists()
+
+
+class CategoryTree:
+    """Снимок дерева категорий: карта детей, глубины и плоский список для select"""
+
+    def __init__(self, categories):
+        self.by_id = {}
+        self.children = defaultdict(list)
+        for category in categories:
+            self.by_id[category.id] = category
+            self.children[category.parent_id].append(category.id)
+
+        self.depth = {}
+        self.choices = []
+        self.tree = self._build(self.children.get(None, []), 0)
+
+    def _build(self, ids, level):
+        nodes = []
+        for category_id in ids:
+            category = self.by_id[category_id]
+            self.depth[category_id] = level
+            self.choices.append((category_id, f"{'--- ' * level}{category.name}"))
+            nodes.append({'category': category, 'children': self._build(self.children.get(category_id, []), level + 1)})
+        return nodes
+
+    def ancestor_ids(self, category_id):
+        """id категории и всех её предков"""
+        while category_id in self.by_id:
+            yield category_id
+            category_id = self.by_id[category_id].parent_id
+
+    @property
+    def roots(self):
+        return [self.by_id[category_id] for category_id in self.children.get(None, [])]
+
+
+TREE_VERSION_KEY = 'category_tree_version'
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """Возвращает дерево категорий из памяти процесса, перестраивая его после изменений"""
+    global _snapshot
+    version = versioning.get_version(TREE_VERSION_KEY)
+    snapshot = _snapshot
+    if snapshot is None or snapshot[0] != version:
+        with _snapshot_lock:
+            snapshot = _snapshot
+            if snapshot is None or snapshot[0] != version:
+                snapshot = (version, CategoryTree(Category.objects.order_by('name')))
+                _snapshot = snapshot
+    return snapshot[1]
+
+
+def invalidate():
+    """Сбрасывает снимок дерева во всех процессах через общий ключ версии"""
+    versioning.bump(TREE_VERSION_KEY)
+
+
+def get_tree():
+    """Дерево категорий: [{'category': ..., 'children': [...]}]"""
+    return get_snapshot().tree
+
+
+def get_roots():
+    """Корневые категории"""
+    return get_snapshot().roots
+
+
+def get_choices(empty_label='---------'):
+    """Плоский список категорий для select с отступами по уровню"""
+    return [('', empty_label)] + get_snapshot().choices
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from products import thumbnails
+from products.models import Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные WebP/JPEG копии для уже загруженных изображений товаров и галерей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Пересоздать копии, даже если они уже есть')
+
+    def handle(self, *args, **options):
+        for label, model in (('Основные изображения', Product), ('Галереи', ProductImage)):
+            built = 0
+            queryset = model.objects.exclude(image='').exclude(image__isnull=True).only('pk', 'image', 'thumbnails')
+            for instance in queryset.iterator(chunk_size=200):
+                if thumbnails.refresh(instance, force=options['force']):
+                    built += 1
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ {label}: копии построены для {built} изображений'
+            ))
@@ -0,0 +1,212 @@
+import json
+import os
+import shutil
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from hashlib import blake2b
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from products import media
+
+CHUNK_SIZE = 2000
+DEFAULT_WORKERS = 8
+DEFAULT_GRACE_HOURS = 24
+# Как часто сохранять контрольную точку
+CHECKPOINT_SECONDS = 30
+
+
+def _fingerprint(name):
+    """64-битный отпечаток пути: миллион путей занимает 8 МБ вместо сотен"""
+    return int.from_bytes(blake2b(name.encode(), digest_size=8).digest(), 'big')
+
+
+class ReferencedNames:
+    """Отсортированный массив отпечатков путей, на которые ссылается база.
+
+    Совпадение отпечатков у разных путей лишь оставляет мусорный файл на месте.
+    """
+
+    def __init__(self, names):
+        self.fingerprints = array('Q', sorted({_fingerprint(name) for name in names}))
+
+    def __contains__(self, name):
+        fingerprint = _fingerprint(name)
+        position = bisect_left(self.fingerprints, fingerprint)
+        return position < len(self.fingerprints) and self.fingerprints[position] == fingerprint
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+def referenced_names():
+    """Пути всех изображений и их копий, потоком из базы без загрузки моделей"""
+    for model in media.IMAGE_MODELS:
+        rows = model.objects.values_list('image', 'thumbnails').order_by()
+        for image_name, thumbnails in rows.iterator(chunk_size=CHUNK_SIZE):
+            yield from media.file_names(image_name, thumbnails)
+
+
+class Checkpoint:
+    """Полностью обработанные каталоги; при завершении поддерева его подкаталоги забываются"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.saved_at = time.monotonic()
+        if path and os.path.exists(path):
+            with open(path) as file:
+                self.done = set(json.load(file)['done'])
+
+    def __contains__(self, directory):
+        return directory in self.done
+
+    def complete(self, directory):
+        prefix = directory + '/' if directory else ''
+        self.done = {done for done in self.done if not done.startswith(prefix)}
+        self.done.add(directory)
+        if self.path and time.monotonic() - self.saved_at > CHECKPOINT_SECONDS:
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'done': sorted(self.done)}, file)
+        os.replace(temporary, self.path)
+        self.saved_at = time.monotonic()
+
+    def finish(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Command(BaseCommand):
+    help = ('Удаляет из MEDIA_ROOT файлы, на которые не ссылается ни один товар или фото галереи '
+            '(старше периода ожидания); обход каталогов параллельный, с контрольными точками')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет удалено')
+        parser.add_argument('--quarantine', metavar='DIR',
+                            help='Переносить файлы в этот каталог вместо удаления')
+        parser.add_argument('--grace-hours', type=float, default=DEFAULT_GRACE_HOURS,
+                            help='Не трогать файлы моложе этого возраста (загрузки, ещё не попавшие в базу)')
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Потоков обхода каталогов')
+        parser.add_argument('--checkpoint', metavar='FILE',
+                            help='Файл контрольной точки: повторный запуск продолжит с места остановки')
+
+    def handle(self, *args, **options):
+        self.root = os.path.abspath(settings.MEDIA_ROOT)
+        if not os.path.isdir(self.root):
+            raise CommandError(f'Каталог {self.root} не найден')
+        quarantine = options['quarantine'] and os.path.abspath(options['quarantine'])
+        if quarantine and (quarantine + os.sep).startswith(self.root + os.sep):
+            raise CommandError('Каталог карантина не должен быть внутри MEDIA_ROOT')
+
+        self.dry_run = options['dry_run']
+        self.quarantine = quarantine
+        self.cutoff = time.time() - options['grace_hours'] * 3600
+        self.referenced = ReferencedNames(referenced_names())
+        self.checkpoint = Checkpoint(options['checkpoint'])
+        self.lock = threading.Lock()
+        self.stats = {'files': 0, 'referenced': 0, 'recent': 0, 'removed': 0, 'bytes': 0}
+        self.stdout.write(f'Файлов в базе: {len(self.referenced)}')
+
+        self._walk(max(options['workers'], 1))
+        if not self.dry_run:
+            self.checkpoint.finish()
+
+        stats = self.stats
+        action = 'будет удалено' if self.dry_run else ('перенесено в карантин' if quarantine else 'удалено')
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Просмотрено файлов: {stats["files"]}, используются: {stats["referenced"]}, '
+            f'свежие: {stats["recent"]}, {action}: {stats["removed"]} ({stats["bytes"] / 1024 / 1024:.1f} МБ)'
+        ))
+
+    def _walk(self, workers):
+        """Обход дерева: каждый каталог сканирует отдельная задача пула.
+
+        Каталог отмечается в контрольной точке, когда обработано всё его поддерево,
+        поэтому после перезапуска завершённые поддеревья не сканируются вовсе.
+        """
+        remaining = {}  # каталог → сколько ещё не завершено (он сам и его подкаталоги)
+        parents = {}
+
+        def finished(directory):
+            while directory is not None:
+                remaining[directory] -= 1
+                if remaining[directory]:
+                    return
+                del remaining[directory]
+                if not self.dry_run:
+                    self.checkpoint.complete(directory)
+                directory = parents.pop(directory)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+
+            def submit(directory, parent):
+                parents[directory] = parent
+                remaining[directory] = 1
+                if parent is not None:
+                    remaining[parent] += 1
+                if directory in self.checkpoint:
+                    finished(directory)
+                else:
+                    pending[executor.submit(self._scan, directory)] = directory
+
+            submit('', None)
+            try:
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        directory = pending.pop(future)
+                        for subdirectory in future.result():
+                            submit(subdirectory, directory)
+                        finished(directory)
+            finally:
+                if not self.dry_run:
+                    self.checkpoint.save()
+
+    def _scan(self, directory):
+        """Обрабатывает файлы одного каталога, возвращает его подкаталоги"""
+        subdirectories, counts = [], dict.fromkeys(self.stats, 0)
+        with os.scandir(os.path.join(self.root, directory)) as entries:
+            for entry in entries:
+                name = f'{directory}/{entry.name}' if directory else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(name)
+                elif entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                    counts['files'] += 1
+                    if name in self.referenced:
+                        counts['referenced'] += 1
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime > self.cutoff:
+                        counts['recent'] += 1
+                        continue
+                    self._remove(entry.path, name)
+                    counts['removed'] += 1
+                    counts['bytes'] += stat.st_size
+        with self.lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+        return sorted(subdirectories)
+
+    def _remove(self, path, name):
+        if self.dry_run:
+            self.stdout.write(f'  {name}')
+        elif self.quarantine:
+            target = os.path.join(self.quarantine, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products import hierarchy
+from products.models import CategoryClosure
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает индекс иерархии категорий (closure table)'
+
+    def handle(self, *args, **options):
+        hierarchy.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Индекс категорий пересобран: {CategoryClosure.objects.count()} связей'
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс товаров (SQLite FTS5)'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Полнотекстовый индекс поддерживается только для SQLite')
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'✅ Поисковый индекс пересобран: {count} товаров'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products import popularity
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счётчики избранного и корзин товаров с фактическими данными (для запуска по расписанию)'
+
+    def handle(self, *args, **options):
+        fixed = popularity.reconcile()
+        self.stdout.write(self.style.SUCCESS(f'✅ Счётчики популярности сверены, исправлено товаров: {fixed}'))
@@ -0,0 +1,244 @@
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+import time
+from stat import S_ISREG
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Product, ProductImage
+from .storage import is_immutable
+
+# Модели, чьи изображения и их копии лежат в хранилище по содержимому
+IMAGE_MODELS = (Product, ProductImage)
+
+# Файлы моложе этого release() не удаляет: их может ждать ещё не сохранённая запись
+RELEASE_GRACE_SECONDS = 60 * 60
+
+
+def file_names(image_name, thumbnails):
+    """Оригинал и все его уменьшенные копии"""
+    names = {image_name} if image_name else set()
+    for entry in ((thumbnails or {}).get('sizes') or {}).values():
+        names.update(name for key, name in entry.items() if key not in ('width', 'height'))
+    return names
+
+
+def referenced(names):
+    """Какие из файлов ещё нужны записям — как оригинал или как уменьшенная копия.
+
+    По одному запросу на модель, сколько бы имён ни проверялось.
+    """
+    names = set(names)
+    found = set()
+    if not names:
+        return found
+    thumbnail_match = Q()
+    for name in names:
+        thumbnail_match |= Q(thumbnails__icontains=f'"{name}"')
+    for model in IMAGE_MODELS:
+        rows = model.objects.filter(Q(image__in=names) | thumbnail_match).values_list('image', 'thumbnails')
+        for image_name, thumbnails in rows:
+            found |= file_names(image_name, thumbnails) & names
+    return found
+
+
+def _recently_saved(storage, name, cutoff):
+    try:
+        return storage.get_modified_time(name).timestamp() > cutoff
+    except NotImplementedError:
+        # Время изменения неизвестно — файл уберёт clean_media
+        return True
+    except OSError:
+        return False
+
+
+def release(names, storage=default_storage):
+    """Удаляет файлы, на которые после удаления или замены изображений не осталось ссылок.
+
+    Одинаковые загрузки хранятся одним файлом, поэтому счётчик ссылок — сами записи в базе.
+    Файл, сохранённый недавно, мог только что достаться новой загрузке, чья запись ещё
+    не зафиксирована (ContentAddressedStorage.save обновляет время изменения), — такие
+    файлы остаются сборщику clean_media, который удалит их после периода ожидания.
+    """
+    names = set(names)
+    cutoff = time.time() - RELEASE_GRACE_SECONDS
+    for name in names - referenced(names):
+        if not _recently_saved(storage, name, cutoff):
+            storage.delete(name)
+
+
+class _PendingRelease:
+    """Файлы, освобождённые в текущей транзакции; проверяются разом после её фиксации"""
+
+    def __init__(self):
+        self.names = set()
+
+    def __call__(self):
+        release(self.names)
+
+
+_pending = threading.local()
+
+
+def release_on_commit(image_name, thumbnails):
+    """Откладывает release() до фиксации транзакции, собирая файлы всех удалённых в ней записей.
+
+    Удаление товара с галереей проверяет ссылки одним пакетом, а не по запросу на файл.
+    """
+    names = file_names(image_name, thumbnails)
+    pending = getattr(_pending, 'release', None)
+    # Отложенная проверка уже выполнена или отменена откатом — начинаем новую
+    if pending is not None and any(func is pending for _, func, _ in transaction.get_connection().run_on_commit):
+        pending.names |= names
+        return
+    pending = _pending.release = _PendingRelease()
+    pending.names |= names
+    transaction.on_commit(pending)
+
+
+# Раздача файлов
+
+# Кэширование файлов с обычными (изменяемыми) именами; файлы по содержимому — на год
+MUTABLE_MAX_AGE = 60 * 60
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """Часть файла [start, start + length) для FileResponse: память не зависит от размера"""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """(начало, конец включительно) для заголовка Range с одним диапазоном.
+
+    None — заголовка нет или он не поддерживается (отдаём файл целиком),
+    False — диапазон вне файла (416).
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-N — последние N байт
+        length = int(last)
+        return (max(size - length, 0), size - 1) if length and size else False
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+def _etag(name, stat):
+    if is_immutable(name):
+        # Имя уже содержит SHA-256 содержимого
+        return '"%s"' % posixpath.splitext(posixpath.basename(name))[0]
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+def _offload(response, name, path):
+    """Передаёт отдачу файла веб-серверу: nginx (X-Accel-Redirect) или Apache/lighttpd (X-Sendfile)"""
+    prefix = getattr(settings, 'MEDIA_X_ACCEL_REDIRECT', '')
+    if prefix:
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name)
+    elif getattr(settings, 'MEDIA_X_SENDFILE', False):
+        response['X-Sendfile'] = path
+    else:
+        return False
+    return True
+
+
+def file_response(request, name):
+    """Ответ с файлом из MEDIA_ROOT: условные запросы, Range, заголовки кэширования.
+
+    Тело отдаётся FileResponse потоком из файла или веб-сервером по заголовку
+    X-Accel-Redirect/X-Sendfile — через память Python файл целиком не проходит.
+    """
+    name = name.replace('\\', '/')
+    if any(part.startswith('.') for part in name.split('/')):
+        raise Http404
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404
+    if not S_ISREG(stat.st_mode):
+        raise Http404
+
+    etag = _etag(name, stat)
+    # Last-Modified передаётся с точностью до секунды
+    modified = int(stat.st_mtime)
+    content_type, encoding = mimetypes.guess_type(name)
+    headers = HttpResponse(content_type=content_type or 'application/octet-stream')
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    headers['ETag'] = etag
+    headers['Last-Modified'] = http_date(modified)
+    headers['Accept-Ranges'] = 'bytes'
+    headers['X-Content-Type-Options'] = 'nosniff'
+    if is_immutable(name):
+        headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        headers['Cache-Control'] = f'public, max-age={MUTABLE_MAX_AGE}'
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=modified, response=headers)
+    if conditional is not headers:
+        return conditional
+
+    if _offload(headers, name, path):
+        return headers
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if 'Range' in request.headers and (not if_range or if_range == etag):
+        byte_range = parse_range(request.headers['Range'], stat.st_size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    start, end = byte_range or (0, stat.st_size - 1)
+    length = max(end - start + 1, 0)
+    if request.method == 'HEAD':
+        response = HttpResponse()
+    elif byte_range:
+        response = FileResponse(RangeFile(open(path, 'rb'), start, length))
+    else:
+        # Файл целиком: WSGI-сервер может отдать его через sendfile (wsgi.file_wrapper)
+        response = FileResponse(open(path, 'rb'))
+    for header, value in headers.items():
+        response[header] = value
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Content-Length'] = str(length)
+    return response
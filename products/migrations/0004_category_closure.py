@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def closure_rows(pairs):
+    """Строки closure table (предок, потомок, глубина) по парам (id, parent_id); копия из products/hierarchy.py"""
+    parents = dict(pairs)
+    rows = []
+    for category_id in parents:
+        ancestor_id, depth = category_id, 0
+        seen = set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append((ancestor_id, category_id, depth))
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+    return rows
+
+
+def fill_closure(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    CategoryClosure = apps.get_model('products', 'CategoryClosure')
+    pairs = Category.objects.order_by().values_list('id', 'parent_id')
+    CategoryClosure.objects.bulk_create([
+        CategoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth)
+        for ancestor_id, descendant_id, depth in closure_rows(pairs)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_alter_category_options'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='category',
+            options={'verbose_name': 'Категория', 'verbose_name_plural': 'Категории'},
+        ),
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(default=0)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='products.category')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='products.category')),
+            ],
+            options={
+                'verbose_name': 'Связь категорий',
+                'verbose_name_plural': 'Иерархия категорий',
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='category_closure_desc_idx')],
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.RunPython(fill_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Полнотекстовый индекс товаров (SQLite FTS5)
+
+from django.db import migrations
+
+from ._search_0005 import index_text
+
+FTS_TABLE = 'products_product_fts'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Product = apps.get_model('products', 'Product')
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        f"USING fts5(name, description, tokenize = 'unicode61 remove_diacritics 0')"
+    )
+    for pk, name, description in Product.objects.values_list('id', 'name', 'description'):
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [pk, index_text(name), index_text(description)]
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_category_closure'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
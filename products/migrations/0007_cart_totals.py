@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:40
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    Cart = apps.get_model('products', 'Cart')
+    CartItem = apps.get_model('products', 'CartItem')
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    items = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+    count = items.annotate(value=models.Sum('quantity')).values('value')
+    total = items.annotate(
+        value=models.Sum(models.F('quantity') * models.F('product__price'), output_field=money)
+    ).values('value')
+    Cart.objects.update(
+        item_count=Coalesce(models.Subquery(count), 0),
+        total_price=Coalesce(models.Subquery(total), models.Value(0), output_field=money),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Общая стоимость'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
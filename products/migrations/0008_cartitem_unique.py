@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:41
+
+from django.db import migrations, models
+
+
+def merge_duplicates(apps, schema_editor):
+    """Сливает повторяющиеся строки корзины в одну с суммарным количеством"""
+    CartItem = apps.get_model('products', 'CartItem')
+    duplicates = (
+        CartItem.objects.order_by().values('cart_id', 'product_id')
+        .annotate(lines=models.Count('id'), keep_id=models.Min('id'), quantity=models.Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for row in duplicates:
+        CartItem.objects.filter(pk=row['keep_id']).update(quantity=row['quantity'])
+        CartItem.objects.filter(cart_id=row['cart_id'], product_id=row['product_id']).exclude(pk=row['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_cart_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='cartitem',
+            name='cartitem_cart_product_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartitem_cart_product_uniq'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:45
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    def count(model_name):
+        model = apps.get_model('products', model_name)
+        rows = model.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        return Coalesce(Subquery(rows.annotate(total=Count('pk')).values('total'), output_field=IntegerField()), 0)
+
+    Product = apps.get_model('products', 'Product')
+    favorites_count, cart_count = count('Favorite'), count('CartItem')
+    Product.objects.update(
+        favorites_count=favorites_count,
+        cart_count=cart_count,
+        popularity=favorites_count + cart_count,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_cartitem_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='popularity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Популярность'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['popularity'], name='product_active_popular_idx'),
+        ),
+    ]
@@ -0,0 +1,108 @@
+"""Копия стеммера из products/search.py в том виде, в каком им заполнен индекс в 0005_product_fts.
+
+Миграции не импортируют живые модули приложения: их изменение не должно ломать
+старые миграции. Модуль с «_» в начале имени загрузчик миграций пропускает.
+"""
+import re
+
+_WORD_RE = re.compile(r'\w+')
+_VOWELS = 'аеиоуыэюя'
+
+
+def _endings(*groups):
+    """Окончания по убыванию длины; для первой группы нужна предшествующая «а» или «я»"""
+    endings = []
+    for needs_a_ya, group in groups:
+        endings += [(ending, needs_a_ya) for ending in group.split()]
+    return sorted(endings, key=lambda item: len(item[0]), reverse=True)
+
+
+PERFECTIVE_GERUND = _endings((True, 'в вши вшись'), (False, 'ив ивши ившись ыв ывши ывшись'))
+ADJECTIVE = _endings((False, 'ее ие ые ое ими ыми ей ий ый ой ем им ым ом его ого ему ому их ых ую юю ая яя ою ею'))
+PARTICIPLE = _endings((True, 'ем нн вш ющ щ'), (False, 'ивш ывш ующ'))
+REFLEXIVE = _endings((False, 'ся сь'))
+VERB = _endings(
+    (True, 'ла на ете йте ли й л ем н ло но ет ют ны ть ешь нно'),
+    (False, 'ила ыла ена ейте уйте ите или ыли ей уй ил ыл им ым ен ило ыло ено ят ует уют ит ыт ены ить ыть ишь ую ю'),
+)
+NOUN = _endings((False, 'а ев ов ие ье е иями ями ами еи ии и ией ей ой ий й иям ям ием ем ам ом о у ах иях ях ы ь ию ью ю ия ья я'))
+SUPERLATIVE = _endings((False, 'ейш ейше'))
+DERIVATIONAL = _endings((False, 'ост ость'))
+
+
+def _regions(word):
+    """Начала областей RV и R2 алгоритма Snowball"""
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in _VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _strip(word, start, endings):
+    """Отрезает самое длинное подходящее окончание, лежащее в области с позиции start"""
+    for ending, needs_a_ya in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= start:
+            stem = word[:-len(ending)]
+            if needs_a_ya and not (stem.endswith(('а', 'я')) and len(stem) - 1 >= start):
+                continue
+            return stem
+    return None
+
+
+def stem(word):
+    """Стеммер Портера (Snowball) для русского языка; прочие слова только нормализуются"""
+    word = word.lower().replace('ё', 'е')
+    if not any('а' <= char <= 'я' for char in word):
+        return word
+
+    rv, r2 = _regions(word)
+
+    # Шаг 1: деепричастия, иначе возвратность + прилагательные/глаголы/существительные
+    stripped = _strip(word, rv, PERFECTIVE_GERUND)
+    if stripped is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        stripped = _strip(word, rv, ADJECTIVE)
+        if stripped is not None:
+            stripped = _strip(stripped, rv, PARTICIPLE) or stripped
+        else:
+            stripped = _strip(word, rv, VERB)
+            if stripped is None:
+                stripped = _strip(word, rv, NOUN)
+    if stripped is not None:
+        word = stripped
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3: словообразовательные суффиксы в R2
+    word = _strip(word, r2, DERIVATIONAL) or word
+
+    # Шаг 4: превосходная степень, двойная «н», мягкий знак
+    superlative = _strip(word, rv, SUPERLATIVE)
+    if superlative is not None:
+        word = superlative
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        word = word[:-1]
+    elif superlative is None and word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Разбивает текст на основы слов"""
+    return [stem(word) for word in _WORD_RE.findall(text or '')]
+
+
+def index_text(text):
+    return ' '.join(tokenize(text))
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from django.db.models.functions import Coalesce
 import os
 from uuid import uuid4
 
@@ -42,6 +44,51 @@ class Category(models.Model):
             return f"{self.parent.name} → {self.name}"
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем родителя, чтобы при сохранении распознать перенос ветки
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+
+    def clean(self):
+        """Запрещает делать категорию потомком самой себя"""
+        from .hierarchy import is_descendant
+
+        if self.pk and self.parent_id and is_descendant(self.parent_id, self.pk):
+            raise ValidationError({'parent': 'Категория не может быть вложена в свою подкатегорию'})
+
+    def save(self, *args, **kwargs):
+        """Сохраняет категорию и поддерживает индекс иерархии (closure table)"""
+        from . import hierarchy
+
+        is_new = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if is_new:
+                hierarchy.insert_node(self)
+            elif getattr(self, '_loaded_parent_id', self.parent_id) != self.parent_id:
+                hierarchy.move_node(self)
+        self._loaded_parent_id = self.parent_id
+
+
+class CategoryClosure(models.Model):
+    """Индекс иерархии категорий: все пары предок → потомок с глубиной"""
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Связь категорий'
+        verbose_name_plural = 'Иерархия категорий'
+        unique_together = ['ancestor', 'descendant']
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='category_closure_desc_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_id} → {self.descendant_id} ({self.depth})"
+
 
 class Shop(models.Model):
     name = models.CharField(max_length=200, verbose_name='Название магазина')
@@ -73,23 +120,61 @@ class Product(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='Добавил')
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True, verbose_name='Активный')
+    # Счётчики популярности обновляются на месте через F() (products/popularity.py),
+    # расхождения исправляет команда reconcile_popularity
+    favorites_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном')
+    cart_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах')
+    popularity = models.PositiveIntegerField(default=0, editable=False, verbose_name='Популярность')
+    COUNTER_FIELDS = ('favorites_count', 'cart_count', 'popularity')
+    # Уменьшенные копии основного изображения, см. products/thumbnails.py
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
         ordering = ['-created_at']
+        # Частичные индексы по активным товарам под сортировки каталога
+        # (SQLite получает фильтр is_active=True как «WHERE is_active» и сопоставляет его с условием индекса)
+        indexes = [
+            models.Index(fields=['created_at'], condition=models.Q(is_active=True), name='product_active_created_idx'),
+            models.Index(fields=['price'], condition=models.Q(is_active=True), name='product_active_price_idx'),
+            models.Index(fields=['name'], condition=models.Q(is_active=True), name='product_active_name_idx'),
+            models.Index(fields=['popularity'], condition=models.Q(is_active=True),
+                         name='product_active_popular_idx'),
+            models.Index(fields=['category', 'price'], condition=models.Q(is_active=True),
+                         name='product_category_price_idx'),
+            models.Index(fields=['created_by', 'created_at'], name='product_owner_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Сохраняет товар, не трогая счётчики популярности уже существующей строки.
+
+        Счётчики меняются только через F(); полное сохранение объекта, загруженного
+        раньше, иначе записало бы поверх инкрементов старые значения.
+        """
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     @property
     def shop_addresses(self):
-        return "\n".join([shop.address for shop in self.shops.all()])
+        from .availability import get_shops
+        shops = getattr(self, 'available_shops', None)
+        if shops is None:
+            shops = get_shops(self.pk)
+        return "\n".join([shop.address for shop in shops])
 
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to=product_gallery_image_path)
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
     order = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -102,24 +187,46 @@ class ProductImage(models.Model):
         return f"Изображение {self.order} для {self.product.name}"
 
 
+class CartQuerySet(models.QuerySet):
+    def refresh_totals(self):
+        """Пересчитывает item_count и total_price корзин одним UPDATE с агрегатами по строкам"""
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        items = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+        count = items.annotate(value=models.Sum('quantity')).values('value')
+        total = items.annotate(
+            value=models.Sum(models.F('quantity') * models.F('product__price'), output_field=money)
+        ).values('value')
+        return self.update(
+            item_count=Coalesce(models.Subquery(count), 0),
+            total_price=Coalesce(models.Subquery(total), models.Value(0), output_field=money),
+        )
+
+
 class Cart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Итоги хранятся в корзине, чтобы счётчик в шапке не обращался к строкам корзины;
+    # обновляются refresh_totals() в той же транзакции, что и изменения строк
+    item_count = models.PositiveIntegerField(default=0, verbose_name='Количество товаров')
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Общая стоимость')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
+    def refresh_totals(self):
+        Cart.objects.filter(pk=self.pk).refresh_totals()
+        self.refresh_from_db(fields=['item_count', 'total_price'])
+
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
 
     @property
     def total_items_property(self):
-        return self.total_items()
-
-    def total_price(self):
-        return sum(item.total_price() for item in self.items.all())
+        return self.item_count
 
     @property
     def total_price_property(self):
-        return self.total_price()
+        return self.total_price
 
     def __str__(self):
         return f"Корзина {self.user.username}"
@@ -131,6 +238,12 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # Уникальность нужна для атомарного добавления в корзину (products/cart.py)
+            models.UniqueConstraint(fields=['cart', 'product'], name='cartitem_cart_product_uniq'),
+        ]
+
     def total_price(self):
         return self.product.price * self.quantity
 
@@ -150,6 +263,7 @@ class Favorite(models.Model):
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные товары'
+        # Уникальный индекс (user, product) покрывает и выборку избранного по пользователю
         unique_together = ['user', 'product']
 
     def __str__(self):
@@ -0,0 +1,109 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, urlencode
+
+from . import versioning
+from .cart import ANONYMOUS_COOKIE
+
+# Метка последнего изменения данных, видимых в каталоге (список, фильтры)
+CATALOG_MODIFIED_KEY = 'page_modified:catalog'
+
+PAGE_TIMEOUT = 60 * 10
+
+
+def product_modified_key(product_id):
+    return f'page_modified:product:{product_id}'
+
+
+def touch(keys):
+    """Отмечает изменение данных: все страницы, зависящие от этих меток, устаревают"""
+    now = time.time()
+    versioning.versions_cache().set_many({key: now for key in keys}, timeout=None)
+
+
+def touch_catalog():
+    touch([CATALOG_MODIFIED_KEY])
+
+
+def touch_products(product_ids):
+    touch([product_modified_key(product_id) for product_id in product_ids])
+
+
+def last_modified(keys):
+    """Самая поздняя метка изменения; потерянные метки считаются изменёнными сейчас"""
+    store = versioning.versions_cache()
+    stamps = store.get_many(keys)
+    missing = [key for key in keys if key not in stamps]
+    if missing:
+        touch(missing)
+        stamps.update(store.get_many(missing))
+    return max(stamps.values(), default=time.time())
+
+
+def normalized_query(request):
+    """Строка запроса без пустых параметров и с упорядоченными ключами"""
+    return urlencode(sorted(
+        (key, value) for key, values in request.GET.lists() for value in values if value != ''
+    ))
+
+
+def _is_cacheable(request):
+    """Кэшируются только GET/HEAD анонимов без отложенных сообщений и без корзины гостя"""
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return False
+    if 'messages' in request.COOKIES or ANONYMOUS_COOKIE in request.COOKIES:
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES and '_messages' in request.session:
+        return False
+    return True
+
+
+def _finalize(request, response, etag, modified):
+    # Last-Modified передаётся с точностью до секунды
+    modified = int(modified)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+    patch_vary_headers(response, ('Cookie',))
+    return get_conditional_response(request, etag=etag, last_modified=modified, response=response)
+
+
+def anonymous_page_cache(modified_keys):
+    """Кэш целых страниц для анонимов с ETag/Last-Modified и ответами 304.
+
+    modified_keys(request, *args, **kwargs) возвращает метки изменений, от которых
+    зависит страница; они входят в ключ кэша, поэтому изменение данных сразу
+    делает устаревшими только затронутые страницы.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable(request):
+                return view_func(request, *args, **kwargs)
+
+            modified = last_modified(modified_keys(request, *args, **kwargs))
+            key_source = f'{request.path}?{normalized_query(request)}'
+            key = f'page:{hashlib.sha1(key_source.encode()).hexdigest()}:{modified!r}'
+
+            entry = cache.get(key)
+            if entry is None:
+                response = view_func(request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming or response.cookies:
+                    return response
+                entry = {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'etag': f'"{hashlib.md5(response.content).hexdigest()}"',
+                }
+                cache.set(key, entry, PAGE_TIMEOUT)
+
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+            return _finalize(request, response, entry['etag'], modified)
+        return wrapper
+    return decorator
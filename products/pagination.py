@@ -0,0 +1,123 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.db.models import Q
+
+# Сортировки, для которых доступна пагинация по курсору (поле + id для однозначности)
+KEYSET_FIELDS = {
+    'created_at': datetime.fromisoformat,
+    'price': Decimal,
+    'name': str,
+    'popularity': int,
+}
+
+CURSOR_SALT = 'products.pagination.cursor'
+
+# Максимум, до которого считается точное количество найденных товаров в режиме курсора
+COUNT_LIMIT = 1000
+
+
+def supports_keyset(sort_by):
+    return sort_by.lstrip('-') in KEYSET_FIELDS
+
+
+def keyset_ordering(sort_by):
+    """Порядок сортировки с id в качестве tie-breaker в том же направлении"""
+    return [sort_by, '-id' if sort_by.startswith('-') else 'id']
+
+
+def estimate_count(queryset, limit=COUNT_LIMIT):
+    """Количество строк, но не больше limit + 1: COUNT по ограниченному подзапросу"""
+    count = queryset.order_by()[:limit + 1].count()
+    return f'{limit}+' if count > limit else count
+
+
+class KeysetPage:
+    """Страница каталога, выбранная по курсору без COUNT и OFFSET"""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """Пагинация по курсору: следующая страница ищется по ключу последней строки"""
+
+    def __init__(self, queryset, sort_by, per_page):
+        self.queryset = queryset
+        self.field = sort_by.lstrip('-')
+        self.descending = sort_by.startswith('-')
+        self.sort_by = sort_by
+        self.per_page = per_page
+
+    def encode_cursor(self, obj, direction):
+        value = getattr(obj, self.field)
+        value = value.isoformat() if isinstance(value, datetime) else str(value)
+        return signing.dumps({'s': self.sort_by, 'v': value, 'id': obj.pk, 'd': direction}, salt=CURSOR_SALT)
+
+    def decode_cursor(self, cursor):
+        """Возвращает (значение, id, направление) или None для битого или чужого курсора"""
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+            if data['s'] != self.sort_by or data['d'] not in ('next', 'prev'):
+                return None
+            return KEYSET_FIELDS[self.field](data['v']), int(data['id']), data['d']
+        except (signing.BadSignature, KeyError, TypeError, ValueError, ArithmeticError):
+            return None
+
+    def _seek(self, value, pk, forward):
+        # Вперёд по убыванию — это «меньше», назад — «больше»
+        lookup = 'lt' if forward == self.descending else 'gt'
+        return Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'id__{lookup}': pk})
+
+    def get_page(self, cursor=None):
+        position = self.decode_cursor(cursor) if cursor else None
+        ordering = keyset_ordering(self.sort_by)
+        queryset = self.queryset
+
+        if position is None:
+            forward = True
+        else:
+            value, pk, direction = position
+            forward = direction == 'next'
+            queryset = queryset.filter(self._seek(value, pk, forward))
+            if not forward:
+                ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        has_next = has_more if forward else True
+        has_previous = position is not None if forward else has_more
+        return KeysetPage(
+            rows,
+            has_next=has_next and bool(rows),
+            has_previous=has_previous and bool(rows),
+            next_cursor=self.encode_cursor(rows[-1], 'next') if rows else None,
+            previous_cursor=self.encode_cursor(rows[0], 'prev') if rows else None,
+        )
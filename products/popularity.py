@@ -0,0 +1,44 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import CartItem, Favorite, Product
+
+FAVORITES = 'favorites_count'
+CARTS = 'cart_count'
+
+
+def change(product_ids, counter, delta):
+    """Сдвигает счётчик и общую популярность товаров одним UPDATE с F(), не уходя ниже нуля"""
+    product_ids = list(product_ids)
+    if not product_ids or not delta:
+        return
+    Product.objects.filter(pk__in=product_ids).update(**{
+        counter: Greatest(F(counter) + delta, 0),
+        'popularity': Greatest(F('popularity') + delta, 0),
+    })
+
+
+def actual_counts(favorite_model=Favorite, cart_item_model=CartItem):
+    """Подзапросы с точными значениями счётчиков товара (модели передаются и из миграций)"""
+    def count(model):
+        rows = model.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        return Coalesce(Subquery(rows.annotate(total=Count('pk')).values('total'), output_field=IntegerField()), 0)
+
+    return {FAVORITES: count(favorite_model), CARTS: count(cart_item_model)}
+
+
+def reconcile():
+    """Исправляет разошедшиеся счётчики пачкой, возвращает количество исправленных товаров"""
+    counts = actual_counts()
+    drifted = Product.objects.annotate(
+        actual_favorites=counts[FAVORITES], actual_carts=counts[CARTS]
+    ).filter(
+        ~Q(favorites_count=F('actual_favorites'))
+        | ~Q(cart_count=F('actual_carts'))
+        | ~Q(popularity=F('actual_favorites') + F('actual_carts'))
+    ).values('pk')
+    return Product.objects.filter(pk__in=Subquery(drifted)).update(
+        favorites_count=counts[FAVORITES],
+        cart_count=counts[CARTS],
+        popularity=counts[FAVORITES] + counts[CARTS],
+    )
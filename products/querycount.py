@@ -0,0 +1,161 @@
+"""Учёт SQL-запросов: поиск N+1 и бюджеты запросов для представлений.
+
+В режиме разработки QueryInspectorMiddleware пишет в лог повторяющиеся запросы
+одной формы с указанием строки шаблона или кода, откуда они пришли. В тестах
+бюджет задаётся через settings.QUERY_BUDGETS (по имени URL) вместе с
+QUERY_INSPECTOR_STRICT = True или через контекстный менеджер query_budget().
+"""
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+logger = logging.getLogger('products.queries')
+
+# Столько одинаковых по форме запросов за запрос к странице считаются N+1
+N_PLUS_ONE_THRESHOLD = 3
+
+_PROJECT_DIR = str(settings.BASE_DIR)
+_THIS_FILE = os.path.abspath(__file__)
+_IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+_NUMBER_RE = re.compile(r'\b\d+\b')
+# Управление транзакциями: каждый atomic() даёт одинаковый BEGIN/SAVEPOINT, это не N+1
+_TRANSACTION_RE = re.compile(r'^\s*(?:BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+# Запросы кэша в базе (DatabaseCache) — это обращения к кэшу, а не к данным страницы
+_CACHE_BACKEND_FILE = os.path.join('django', 'core', 'cache', 'backends', 'db.py')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Представление выполнило больше запросов, чем разрешено бюджетом"""
+
+
+def query_shape(sql):
+    """Форма запроса без конкретных значений: списки IN и числа схлопываются"""
+    return _NUMBER_RE.sub('N', _IN_LIST_RE.sub('IN (...)', sql))
+
+
+def find_origin():
+    """Строка шаблона и/или строка кода проекта, из которых выполнен запрос"""
+    template_origin = code_origin = None
+    frame = sys._getframe(2)
+    while frame is not None and not (template_origin and code_origin):
+        # type(), а не isinstance(): ленивые объекты (request.user) вычислились бы запросом
+        node = frame.f_locals.get('self')
+        if template_origin is None and issubclass(type(node), Node) and getattr(node, 'token', None):
+            origin = getattr(node, 'origin', None)
+            if origin is not None:
+                template_origin = f'{origin.template_name}:{node.token.lineno}'
+
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (code_origin is None and filename.startswith(_PROJECT_DIR) and filename != _THIS_FILE
+                and 'site-packages' not in filename):
+            code_origin = f'{os.path.relpath(filename, _PROJECT_DIR)}:{frame.f_lineno} ({frame.f_code.co_name})'
+        frame = frame.f_back
+
+    return ' ← '.join(origin for origin in (template_origin, code_origin) if origin) or 'неизвестно'
+
+
+def _from_cache_backend():
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_filename.endswith(_CACHE_BACKEND_FILE):
+            return True
+        frame = frame.f_back
+    return False
+
+
+class QueryLog:
+    """execute_wrapper, запоминающий SQL, форму, источник и время каждого запроса"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if _from_cache_backend():
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'shape': query_shape(sql),
+                'origin': find_origin(),
+                'time': time.perf_counter() - start,
+            })
+
+    def __len__(self):
+        return len(self.queries)
+
+    def duplicates(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """Группы одинаковых по форме запросов: [(форма, количество, Counter источников)]"""
+        groups = defaultdict(list)
+        for query in self.queries:
+            if not _TRANSACTION_RE.match(query['sql']):
+                groups[query['shape']].append(query['origin'])
+        return [
+            (shape, len(origins), Counter(origins))
+            for shape, origins in groups.items()
+            if len(origins) >= threshold
+        ]
+
+    def report(self, threshold=N_PLUS_ONE_THRESHOLD):
+        lines = [f'Всего запросов: {len(self)}']
+        for shape, count, origins in self.duplicates(threshold):
+            lines.append(f'N+1: {count} × {shape[:200]}')
+            lines += [f'    {times} × {origin}' for origin, times in origins.most_common()]
+        return '\n'.join(lines)
+
+
+@contextmanager
+def capture_queries(using='default'):
+    log = QueryLog()
+    with connections[using].execute_wrapper(log):
+        yield log
+
+
+@contextmanager
+def query_budget(limit, n_plus_one=True, using='default'):
+    """Для тестов: падает, если блок выполнил больше limit запросов или (по умолчанию) содержит N+1"""
+    with capture_queries(using) as log:
+        yield log
+    if len(log) > limit:
+        raise QueryBudgetExceeded(f'Бюджет {limit} запросов превышен.\n{log.report()}')
+    if n_plus_one and log.duplicates():
+        raise QueryBudgetExceeded(f'Обнаружены N+1 запросы.\n{log.report()}')
+
+
+class QueryInspectorMiddleware:
+    """Пишет в лог N+1 запросы и проверяет бюджеты QUERY_BUDGETS для каждого запроса к странице"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with capture_queries() as log:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else request.path
+        response['X-Query-Count'] = str(len(log))
+
+        problems = []
+        if log.duplicates():
+            problems.append(f'{view_name}: обнаружены N+1 запросы')
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+        if budget is not None and len(log) > budget:
+            problems.append(f'{view_name}: {len(log)} запросов при бюджете {budget}')
+
+        if problems:
+            message = '\n'.join(problems) + '\n' + log.report()
+            if getattr(settings, 'QUERY_INSPECTOR_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,167 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import (
+    availability, cart, cards, favorites, geo, hierarchy, media, page_cache, popularity, search, suggest, thumbnails,
+    versioning,
+)
+from .models import Cart, CartItem, Category, Favorite, Product, ProductImage, Shop
+
+
+def catalog_changed():
+    """Сбрасывает кэши, построенные по данным каталога"""
+    versioning.bump(versioning.CATALOG_VERSION_KEY)
+
+
+def touch_pages(product_ids, catalog=True):
+    """Отмечает изменение страниц каталога и карточек товаров для кэша анонимов"""
+    product_ids = list(product_ids)
+    if catalog:
+        transaction.on_commit(page_cache.touch_catalog)
+    if product_ids:
+        transaction.on_commit(lambda: page_cache.touch_products(product_ids))
+
+
+@receiver([post_save, pre_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    """Сбрасывает кэш дерева категорий после фиксации транзакции"""
+    transaction.on_commit(hierarchy.invalidate)
+    transaction.on_commit(suggest.categories_changed)
+    transaction.on_commit(catalog_changed)
+    transaction.on_commit(cards.invalidate_all)
+    # Название категории выводится на странице товара
+    touch_pages(Product.objects.filter(category_id=instance.pk).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    """Обновляет товар в полнотекстовом индексе"""
+    search.index_product(instance)
+    # Цена могла измениться — пересчитываем корзины, где лежит товар
+    Cart.objects.filter(items__product=instance).refresh_totals()
+    transaction.on_commit(lambda: suggest.product_changed(instance.pk))
+    transaction.on_commit(catalog_changed)
+    transaction.on_commit(lambda: cards.invalidate_product(instance.pk))
+    touch_pages([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+    transaction.on_commit(lambda: suggest.product_changed(instance.pk))
+    transaction.on_commit(catalog_changed)
+    transaction.on_commit(lambda: cards.invalidate_product(instance.pk))
+    transaction.on_commit(lambda: availability.invalidate([instance.pk]))
+    touch_pages([instance.pk])
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductImage)
+def remember_image(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Запоминает прежнее изображение: после замены его файлы могут остаться без ссылок"""
+    if raw or instance.pk is None or (update_fields is not None and 'image' not in update_fields):
+        return
+    instance._previous_image = sender.objects.filter(pk=instance.pk).values_list('image', 'thumbnails').first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def image_saved(sender, instance, raw=False, **kwargs):
+    """Строит уменьшенные копии загруженного изображения"""
+    if raw:
+        return
+    thumbnails.refresh(instance)
+    previous = getattr(instance, '_previous_image', None)
+    if previous and previous[0] != instance.image.name:
+        media.release_on_commit(*previous)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def image_deleted(sender, instance, **kwargs):
+    """Одинаковые изображения хранятся одним файлом — удаляем его, только если ссылок не осталось"""
+    media.release_on_commit(instance.image.name, instance.thumbnails)
+
+
+def gallery_changed(product_id):
+    """Сбрасывает кэши после изменения галереи (и при bulk_create, который сигналы не вызывает)"""
+    transaction.on_commit(catalog_changed)
+    transaction.on_commit(lambda: cards.invalidate_product(product_id))
+    # Галерея видна только на странице товара
+    touch_pages([product_id], catalog=False)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def product_image_changed(sender, instance, **kwargs):
+    gallery_changed(instance.product_id)
+
+
+@receiver([post_save, pre_delete], sender=Shop)
+def shop_changed(sender, instance, **kwargs):
+    transaction.on_commit(geo.invalidate)
+    transaction.on_commit(catalog_changed)
+    transaction.on_commit(cards.invalidate_all)
+    # Название, адрес и часы работы закэшированы в списках магазинов товаров
+    product_ids = list(instance.product_set.values_list('id', flat=True))
+    transaction.on_commit(lambda: availability.invalidate(product_ids))
+    touch_pages(product_ids)
+
+
+@receiver(m2m_changed, sender=Product.shops.through)
+def product_shops_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Со стороны магазина (shop.product_set) затронутые товары приходят в pk_set,
+    # а при очистке их нужно запомнить до удаления связей
+    if reverse and action == 'pre_clear':
+        instance._cleared_product_ids = list(instance.product_set.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == 'post_clear':
+        product_ids = getattr(instance, '_cleared_product_ids', [])
+    else:
+        product_ids = list(pk_set or ())
+
+    transaction.on_commit(catalog_changed)
+    for product_id in product_ids:
+        transaction.on_commit(lambda product_id=product_id: cards.invalidate_product(product_id))
+    transaction.on_commit(lambda: availability.invalidate(product_ids))
+    touch_pages(product_ids)
+
+
+@receiver(post_save, sender=CartItem)
+def cart_item_saved(sender, instance, created, **kwargs):
+    """Итоги корзины обновляются в той же транзакции, что и её строки"""
+    Cart.objects.filter(pk=instance.cart_id).refresh_totals()
+    if created:
+        popularity.change([instance.product_id], popularity.CARTS, 1)
+
+
+@receiver(post_delete, sender=CartItem)
+def cart_item_deleted(sender, instance, **kwargs):
+    Cart.objects.filter(pk=instance.cart_id).refresh_totals()
+    popularity.change([instance.product_id], popularity.CARTS, -1)
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Переносит корзину, собранную до входа, в корзину пользователя"""
+    if request is not None:
+        cart.merge_anonymous(request, user)
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_added(sender, instance, created, **kwargs):
+    if created:
+        popularity.change([instance.product_id], popularity.FAVORITES, 1)
+        transaction.on_commit(lambda: favorites.invalidate(instance.user_id))
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_removed(sender, instance, **kwargs):
+    popularity.change([instance.product_id], popularity.FAVORITES, -1)
+    transaction.on_commit(lambda: favorites.invalidate(instance.user_id))
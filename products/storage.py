@@ -0,0 +1,63 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+# Имя файла по содержимому: <каталог>/ab/cd/abcd…(sha256).<расширение>
+CONTENT_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.[0-9a-z]+$')
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def is_immutable(name):
+    """Файл с именем по содержимому никогда не меняется — его можно кэшировать бессрочно"""
+    return bool(CONTENT_NAME_RE.search(name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, где имя файла — SHA-256 его содержимого.
+
+    Из запрошенного имени (его строит upload_to) берутся только каталог и расширение.
+    Одинаковые файлы хранятся один раз: повторное сохранение возвращает уже
+    существующее имя. Файл может принадлежать нескольким записям, поэтому удалять
+    его можно только после проверки ссылок (products/media.py).
+    """
+
+    content_addressed = True
+
+    def __init__(self, **kwargs):
+        # Одно имя — одно содержимое: при гонке перезапись файла тем же содержимым безопасна
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def content_name(self, name, content):
+        directory, basename = posixpath.split(name.replace('\\', '/'))
+        extension = posixpath.splitext(basename)[1].lower()
+        digest = content_hash(content)
+        return posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # Свежее время изменения защищает файл от удаления (media.release, clean_media),
+            # пока новая запись, ссылающаяся на него, ещё не сохранена в базе
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # Файл удалили между проверками — записываем заново
+                pass
+        return super().save(name, content, max_length=max_length)
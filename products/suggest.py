@@ -0,0 +1,226 @@
+import bisect
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.core.cache.backends.base import BaseCache
+from django.urls import reverse
+
+from . import hierarchy, versioning
+from .models import Product
+
+# Журнал изменений в общем кэше: номер последнего изменения (в кэше версий) и записи по номерам
+CHANGES_SEQ_KEY = 'suggest_changes_seq'
+CHANGE_TIMEOUT = 60 * 60
+# Если отстали больше чем на столько изменений, проще перестроить индекс целиком
+MAX_INCREMENTAL_CHANGES = 500
+
+MIN_SIMILARITY = 0.45
+
+_WORD_RE = re.compile(r'\w+')
+
+# Раскладки клавиатуры: запрос, набранный не в той раскладке, тоже ищется
+_LATIN = "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+_CYRILLIC = 'йцукенгшщзхъфывапролджэячсмитьбюё'
+_LAYOUT_SWAP = str.maketrans(_LATIN + _CYRILLIC, _CYRILLIC + _LATIN)
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+def tokenize(text):
+    return _WORD_RE.findall(normalize(text))
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(left, right):
+    """Коэффициент Дайса по триграммам"""
+    return 2 * len(left & right) / (len(left) + len(right))
+
+
+class SuggestIndex:
+    """Префиксный и триграммный индекс названий товаров и категорий в памяти процесса"""
+
+    def __init__(self):
+        self.entries = {}
+        self.token_entries = defaultdict(set)
+        self.sorted_tokens = []
+        self.trigram_tokens = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def add(self, key, name, url):
+        tokens = set(tokenize(name))
+        self.entries[key] = {'name': name, 'url': url, 'tokens': tokens}
+        for token in tokens:
+            if token not in self.token_entries:
+                bisect.insort(self.sorted_tokens, token)
+                for trigram in trigrams(token):
+                    self.trigram_tokens[trigram].add(token)
+            self.token_entries[token].add(key)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            for token in entry['tokens']:
+                self.token_entries[token].discard(key)
+
+    def _match_word(self, word):
+        """Оценки записей для одного слова запроса: префикс — 1.0, похожие слова — по триграммам"""
+        scores = {}
+
+        def credit(token, score):
+            for key in self.token_entries.get(token, ()):
+                if score > scores.get(key, 0):
+                    scores[key] = score
+
+        position = bisect.bisect_left(self.sorted_tokens, word)
+        while position < len(self.sorted_tokens) and self.sorted_tokens[position].startswith(word):
+            token = self.sorted_tokens[position]
+            credit(token, 1.0 if token == word else 0.9)
+            position += 1
+
+        if len(word) >= 3:
+            word_trigrams = trigrams(word)
+            candidates = set()
+            for trigram in word_trigrams:
+                candidates |= self.trigram_tokens.get(trigram, set())
+            for token in candidates:
+                # Сравниваем и с целым словом, и с его началом той же длины — запрос может быть недописан
+                similarity = max(
+                    _similarity(word_trigrams, trigrams(token)),
+                    _similarity(word_trigrams, trigrams(token[:len(word)])),
+                )
+                if similarity >= MIN_SIMILARITY:
+                    credit(token, 0.8 * similarity)
+        return scores
+
+    def _score(self, words):
+        total = None
+        for word in words:
+            scores = self._match_word(word)
+            total = scores if total is None else {key: total[key] + score for key, score in scores.items() if key in total}
+        return total or {}
+
+    def search(self, query, limit=8):
+        words = tokenize(query)
+        if not words:
+            return []
+        with self.lock:
+            scores = self._score(words)
+            for key, score in self._score(tokenize(normalize(query).translate(_LAYOUT_SWAP))).items():
+                if score > scores.get(key, 0):
+                    scores[key] = score
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self.entries[item[0]]['name']))
+            return [
+                {
+                    'type': 'product' if key[0] == 'p' else 'category',
+                    'id': key[1],
+                    'name': self.entries[key]['name'],
+                    'url': self.entries[key]['url'],
+                    'score': round(score / len(words), 3),
+                }
+                for key, score in ranked[:limit]
+            ]
+
+
+def _product_url(product_id):
+    return reverse('product_detail', args=[product_id])
+
+
+def _category_url(category_id):
+    return f"{reverse('product_list')}?category={category_id}"
+
+
+def build_index():
+    index = SuggestIndex()
+    for product_id, name in Product.objects.filter(is_active=True).order_by().values_list('id', 'name'):
+        index.add(('p', product_id), name, _product_url(product_id))
+    for category_id, category in hierarchy.get_snapshot().by_id.items():
+        index.add(('c', category_id), category.name, _category_url(category_id))
+    return index
+
+
+def _apply_products(index, product_ids):
+    active = dict(Product.objects.filter(id__in=product_ids, is_active=True).values_list('id', 'name'))
+    with index.lock:
+        for product_id in product_ids:
+            index.remove(('p', product_id))
+            if product_id in active:
+                index.add(('p', product_id), active[product_id], _product_url(product_id))
+
+
+_index = None
+_index_seq = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Индекс процесса, догоняющий общий журнал изменений"""
+    global _index, _index_seq
+    seq = versioning.versions_cache().get(CHANGES_SEQ_KEY, 0)
+    if _index is not None and _index_seq == seq:
+        return _index
+
+    with _index_lock:
+        if _index is not None and _index_seq == seq:
+            return _index
+        changes = None
+        if _index is not None and _index_seq is not None and 0 < seq - _index_seq <= MAX_INCREMENTAL_CHANGES:
+            keys = [f'suggest_change:{number}' for number in range(_index_seq + 1, seq + 1)]
+            found = cache.get_many(keys)
+            if len(found) == len(keys):
+                changes = set(found.values())
+
+        if changes is None:
+            _index = build_index()
+        else:
+            _apply_products(_index, changes)
+        _index_seq = seq
+    return _index
+
+
+def _has_atomic_incr(store):
+    """Redis и Memcached увеличивают число атомарно; BaseCache.incr (DatabaseCache) — это get + set"""
+    return type(store).incr is not BaseCache.incr
+
+
+def _force_rebuild():
+    """Новый номер без записей журнала: все процессы перестроят индекс целиком.
+
+    Номер — отметка времени, поэтому он не совпадёт ни с одним из прежних.
+    """
+    versioning.versions_cache().set(CHANGES_SEQ_KEY, time.time_ns(), timeout=None)
+
+
+def product_changed(product_id):
+    """Ставит товар в очередь на переиндексацию во всех процессах.
+
+    Без атомарного incr два одновременных изменения могли бы получить один номер,
+    и одно из них потерялось бы — тогда журнал не ведётся, индекс перестраивается.
+    """
+    store = versioning.versions_cache()
+    if not _has_atomic_incr(store):
+        _force_rebuild()
+        return
+    try:
+        seq = store.incr(CHANGES_SEQ_KEY)
+    except ValueError:
+        # Начинаем с отметки времени, чтобы после потери ключа номера не совпали со старыми
+        store.add(CHANGES_SEQ_KEY, time.time_ns(), timeout=None)
+        seq = store.incr(CHANGES_SEQ_KEY)
+    cache.set(f'suggest_change:{seq}', product_id, CHANGE_TIMEOUT)
+
+
+def categories_changed():
+    _force_rebuild()
+
+
+def suggest(query, limit=8):
+    return get_index().search(query, limit)
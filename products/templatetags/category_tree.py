@@ -1,22 +1,24 @@
 from django import template
-from products.models import Category
+from products import hierarchy
 
 register = template.Library()
 
 
-@register.inclusion_tag('products/category_tree.html')
-def render_category_tree(selected_category=None):
-    def get_categories_with_children(parent=None):
-        categories = Category.objects.filter(parent=parent).order_by('name')
-        result = []
-        for category in categories:
-            result.append({
-                'category': category,
-                'children': get_categories_with_children(category)
-            })
-        return result
+def _with_counts(nodes, counts):
+    return [
+        {
+            'category': node['category'],
+            'count': counts.get(node['category'].id, 0),
+            'children': _with_counts(node['children'], counts),
+        }
+        for node in nodes
+    ]
+
 
+@register.inclusion_tag('products/category_tree.html')
+def render_category_tree(selected_category=None, counts=None):
+    tree = hierarchy.get_tree()
     return {
-        'categories_tree': get_categories_with_children(),
+        'categories_tree': _with_counts(tree, counts) if counts is not None else tree,
         'selected_category': selected_category
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,31 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from products.thumbnails import SIZES
+
+register = template.Library()
+
+
+def _sizes(thumbnails):
+    return (thumbnails or {}).get('sizes') or {}
+
+
+@register.filter
+def thumbnail(thumbnails, size):
+    """URL уменьшенной копии: 'card' — JPEG, 'card.webp' — WebP; пусто, если копий нет"""
+    size, _, fmt = size.partition('.')
+    entry = _sizes(thumbnails).get(size)
+    if not entry:
+        return ''
+    return default_storage.url(entry['webp' if fmt == 'webp' else 'jpeg'])
+
+
+@register.filter
+def srcset(thumbnails, fmt='jpeg'):
+    """Значение srcset со всеми размерами копий в формате fmt"""
+    candidates = {}
+    for size in SIZES:
+        entry = _sizes(thumbnails).get(size)
+        if entry:
+            candidates[entry['width']] = default_storage.url(entry[fmt])
+    return ', '.join(f'{url} {width}w' for width, url in sorted(candidates.items()))
@@ -0,0 +1,133 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+
+from . import cart as cart_service
+from . import catalog, pagination
+from .models import Cart, CartItem, Category, Product, Shop
+from .querycount import QueryBudgetExceeded, QueryLog, query_budget
+
+CATALOG_SORTS = ['-created_at', 'created_at', 'price', '-price', 'name', '-name', '-popularity']
+
+# Фильтры, с которыми реально строятся запросы каталога (значения подставляются только для плана)
+CATALOG_FILTER_SETS = {
+    'без фильтров': {},
+    'категория': {'category': '1'},
+    'цена': {'price_min': '100', 'price_max': '500'},
+    'категория + цена': {'category': '1', 'price_min': '100'},
+    'магазин': {'shop': '1'},
+}
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Планы запросов проверяются для SQLite')
+class CatalogIndexTests(TestCase):
+    """Запросы каталога при всех сортировках и фильтрах используют индексы, а не полный просмотр"""
+
+    def test_catalog_queries_use_indexes(self):
+        full_scan = rf'\bSCAN {re.escape(Product._meta.db_table)}\b(?! USING)'
+        for filter_name, params in CATALOG_FILTER_SETS.items():
+            filters = catalog.get_filters(params)
+            for sort_by in CATALOG_SORTS:
+                with self.subTest(filters=filter_name, sort=sort_by):
+                    queryset = catalog.filter_products(filters).order_by(*pagination.keyset_ordering(sort_by))
+                    self.assertNotRegex(queryset.explain(), full_scan)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    """Параллельные добавления одного товара в корзину не теряются и не создают лишних строк"""
+
+    WORKERS = 8
+    ADDS = 25
+
+    def test_concurrent_adds_are_all_counted(self):
+        user = get_user_model().objects.create_user(username='cart-concurrency')
+        product = Product.objects.create(name='Проверка корзины', price=1, created_by=user)
+        cart = cart_service.get_cart(user)
+
+        def worker():
+            try:
+                for _ in range(self.ADDS):
+                    while True:
+                        try:
+                            cart_service.add_item(cart, product.pk)
+                            break
+                        except OperationalError:
+                            # SQLite: база занята другим писателем — повторяем
+                            continue
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            for future in [pool.submit(worker) for _ in range(self.WORKERS)]:
+                future.result()
+
+        expected = self.WORKERS * self.ADDS
+        lines = CartItem.objects.filter(cart=cart, product=product)
+        self.assertEqual(lines.count(), 1)
+        self.assertEqual(lines.get().quantity, expected)
+        self.assertEqual(Cart.objects.get(pk=cart.pk).item_count, expected)
+
+
+class PopularityCounterTests(TestCase):
+    """Сохранение ранее загруженного товара не затирает счётчики, изменённые через F()"""
+
+    def test_full_save_keeps_counters(self):
+        user = get_user_model().objects.create_user(username='counters')
+        product = Product.objects.create(name='Проверка счётчиков', price=1, created_by=user)
+        cart_service.add_item(cart_service.get_cart(user), product.pk)
+
+        product.price = 7
+        product.save()
+
+        product = Product.objects.get(pk=product.pk)
+        self.assertEqual(product.price, 7)
+        self.assertEqual(product.cart_count, 1)
+        self.assertEqual(product.popularity, 1)
+
+
+class CatalogQueryBudgetTests(TestCase):
+    """Страница каталога укладывается в бюджет запросов и не делает N+1 на карточках"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='budget')
+        shops = [Shop.objects.create(name=f'Магазин {number}', address=f'Улица {number}', owner=cls.user)
+                 for number in range(3)]
+        categories = [Category.objects.create(name=f'Категория {number}') for number in range(3)]
+        for number in range(12):
+            product = Product.objects.create(name=f'Товар {number}', price=number + 1, created_by=cls.user,
+                                             category=categories[number % len(categories)])
+            product.shops.set(shops[:number % len(shops) + 1])
+
+    def test_product_list_within_budget(self):
+        self.client.force_login(self.user)
+        url = reverse('product_list')
+        for params in ({}, {'sort': 'price'}, {'sort': 'popular', 'paginate': 'cursor'}):
+            with self.subTest(params=params), query_budget(settings.QUERY_BUDGETS['product_list']):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+
+    def test_repeated_queries_are_reported(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(20):
+                for product in Product.objects.all()[:5]:
+                    product.category.name
+
+
+class QueryLogTests(SimpleTestCase):
+    """Служебные запросы транзакций не считаются N+1"""
+
+    def test_transaction_statements_are_not_duplicates(self):
+        log = QueryLog()
+        for _ in range(3):
+            for sql in ('BEGIN', 'SELECT 1 FROM "products_cart" WHERE "id" = %s'):
+                log(lambda *args: None, sql, (1,), False, {})
+        self.assertEqual(len(log), 6)
+        self.assertEqual([shape for shape, _, _ in log.duplicates()],
+                         ['SELECT N FROM "products_cart" WHERE "id" = %s'])
@@ -0,0 +1,107 @@
+import logging
+import os
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger('products.thumbnails')
+
+# Размеры уменьшенных копий: изображение вписывается в рамку, не увеличиваясь
+SIZES = {
+    'thumb': (240, 240),
+    'card': (640, 640),
+    'zoom': (1600, 1600),
+}
+
+# WebP для браузеров, которые его понимают, JPEG — запасной вариант
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def derivative_name(field, size, fmt):
+    """Копия лежит в каталоге upload_to оригинала: products/main/abc.jpg → products/main/abc.card.webp.
+
+    Каталог берётся из upload_to, а не из имени оригинала: иначе хранилище по
+    содержимому разложило бы копии по своим подкаталогам внутри подкаталогов оригинала.
+    """
+    stem = os.path.splitext(os.path.basename(field.name))[0]
+    extension = FORMATS[fmt][1]
+    directory = os.path.dirname(field.field.generate_filename(field.instance, f'{stem}.{extension}'))
+    return posixpath.join(directory, f'{stem}.{size}.{extension}')
+
+
+def _encode(image, fmt):
+    pil_format, _, options = FORMATS[fmt]
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        # У JPEG нет прозрачности — подкладываем белый фон
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if image.mode == 'RGBA' else None)
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def _render(field, original):
+    storage = field.storage
+    original = original.convert('RGBA' if original.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    sizes, previous = {}, None
+    for size, box in SIZES.items():
+        image = original.copy()
+        image.thumbnail(box, Image.LANCZOS)
+        if previous and (previous['width'], previous['height']) == image.size:
+            # Оригинал меньше рамки — больший размер совпал бы с предыдущим
+            sizes[size] = previous
+            continue
+        entry = {'width': image.width, 'height': image.height}
+        for fmt in FORMATS:
+            name = derivative_name(field, size, fmt)
+            if not getattr(storage, 'content_addressed', False):
+                storage.delete(name)
+            entry[fmt] = storage.save(name, _encode(image, fmt))
+        sizes[size] = previous = entry
+    return sizes
+
+
+def build(field, original=None):
+    """Строит все размеры в обоих форматах, возвращает описание для поля thumbnails.
+
+    original — уже открытое и повёрнутое по EXIF изображение, чтобы не декодировать файл заново.
+    Если изображение не читается, копий нет — шаблоны покажут оригинал.
+    """
+    try:
+        if original is None:
+            with field.open('rb') as source:
+                original = ImageOps.exif_transpose(Image.open(source))
+                original.load()
+        sizes = _render(field, original)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        # Повторить можно командой build_thumbnails --force
+        logger.warning('Не удалось построить копии %s: %s', field.name, error)
+        sizes = {}
+    return {'source': field.name, 'sizes': sizes}
+
+
+def refresh(instance, force=False):
+    """Пересоздаёт копии, если изображение объекта сменилось; True, если поле thumbnails обновлено.
+
+    Сохраняется через update(), чтобы не вызывать сигналы модели повторно.
+    """
+    field = instance.image
+    current = instance.thumbnails or {}
+    if not field:
+        if not current:
+            return False
+        thumbnails = {}
+    elif current.get('source') == field.name and not force:
+        return False
+    else:
+        thumbnails = build(field)
+
+    type(instance).objects.filter(pk=instance.pk).update(thumbnails=thumbnails)
+    instance.thumbnails = thumbnails
+    return True
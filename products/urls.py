@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('', views.product_list, name='product_list'),
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
+    path('suggest/', views.product_suggest, name='product_suggest'),
 
     # Управление товарами
     path('manage/', views.product_manage, name='product_manage'),
@@ -15,10 +16,12 @@ urlpatterns = [
     path('cart/', views.cart_view, name='cart_view'),
     path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/remove/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/update/', views.cart_update, name='cart_update'),
 
     # Магазины
     path('shops/', views.shop_list, name='shop_list'),
     path('nearest-shops/', views.nearest_shops, name='nearest_shops'),
+    path('shops/map/', views.shop_map_markers, name='shop_map_markers'),
 
     # Управление магазинами для менеджеров
     path('shops/manage/', views.shop_manage, name='shop_manage'),
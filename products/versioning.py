@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+
+# Общая версия каталога: товары, изображения, магазины и категории
+CATALOG_VERSION_KEY = 'catalog_version'
+
+# Отдельный кэш для версий и меток изменений, куда не попадают вытесняемые фрагменты
+VERSIONS_CACHE = 'versions'
+
+
+def versions_cache():
+    """Кэш версий; без отдельного алиаса в CACHES — кэш по умолчанию"""
+    return caches[VERSIONS_CACHE if VERSIONS_CACHE in settings.CACHES else DEFAULT_CACHE_ALIAS]
+
+
+def _new_version():
+    # Версия с отметкой времени не совпадёт ни с одной старой, даже если ключ вытеснен из кэша
+    return time.time_ns()
+
+
+def get_version(key):
+    """Текущая версия из общего кэша (одна на все процессы)"""
+    store = versions_cache()
+    version = store.get(key)
+    if version is None:
+        store.add(key, _new_version(), timeout=None)
+        version = store.get(key)
+    # Без рабочего кэша версия меняется на каждый запрос, т.е. кэширование отключается
+    return version if version is not None else _new_version()
+
+
+def bump(key):
+    """Увеличивает версию, делая устаревшими все значения, построенные на старой"""
+    store = versions_cache()
+    try:
+        store.incr(key)
+    except ValueError:
+        store.set(key, _new_version(), timeout=None)
+
+
+def get_versions(keys):
+    """Версии для нескольких ключей за одно обращение к кэшу"""
+    store = versions_cache()
+    versions = store.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        store.set_many(missing, timeout=None)
+        versions.update(missing)
+    return versions
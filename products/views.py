@@ -1,15 +1,49 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
-from .models import Product, Category, Cart, CartItem, ProductImage, Shop, Favorite
+from django.http import Http404, JsonResponse
+from .models import Product, Cart, Shop, Favorite
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST, require_safe
 from django.contrib import messages
 from users.decorators import manager_required
 from .forms import ProductForm, ProductImageForm, ShopForm
 from django.core.paginator import Paginator
 from django.db import models
-from django.db.models import Q
+from functools import partial
+import json
+import math
+from . import availability, cards, catalog, facets, favorites, gallery, geo, hierarchy, media, pagination, suggest
+from . import cart as cart_service
+from .page_cache import anonymous_page_cache, CATALOG_MODIFIED_KEY, product_modified_key
+from .pagination import KeysetPaginator
 
+PRODUCTS_PER_PAGE = 6
 
+SORT_ALIASES = {
+    'popular': '-popularity',
+}
+
+NEAREST_SHOPS_LIMIT = 20
+NEAREST_SHOPS_MAX_LIMIT = 100
+SHOPS_PER_PAGE = 20
+MAP_MAX_SHOPS = 1000
+
+
+def _int_param(value, default, minimum, maximum):
+    try:
+        return min(max(int(value), minimum), maximum)
+    except (TypeError, ValueError):
+        return default
+
+
+def _float_param(value, default, minimum, maximum):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return min(max(value, minimum), maximum) if math.isfinite(value) else default
+
+
+@anonymous_page_cache(lambda request: [CATALOG_MODIFIED_KEY])
 def product_list(request):
     search_query = request.GET.get('q', '')
     category_filter = request.GET.get('category', '')
@@ -18,57 +52,60 @@ def product_list(request):
     price_max = request.GET.get('price_max', '')
     sort_by = request.GET.get('sort', '-created_at')
     page_number = request.GET.get('page', 1)
+    cursor = request.GET.get('cursor', '')
 
-    # Базовый запрос
-    products = Product.objects.filter(is_active=True)
-
-    # ФИЛЬТРАЦИЯ ПО КАТЕГОРИИ С ИЕРАРХИЕЙ
-    if category_filter:
-        def get_all_subcategories(category_id):
-            subcategories = [category_id]
-            children = Category.objects.filter(parent_id=category_id)
-            for child in children:
-                subcategories.extend(get_all_subcategories(child.id))
-            return subcategories
-
-        all_category_ids = get_all_subcategories(int(category_filter))
-        products = products.filter(category_id__in=all_category_ids)
-
-    # Фильтрация по магазину
-    if shop_filter:
-        products = products.filter(shops__id=shop_filter)
-
-    # Фильтрация по цене
-    if price_min:
-        products = products.filter(price__gte=price_min)
-    if price_max:
-        products = products.filter(price__lte=price_max)
-
-    # ПОИСК С РУССКОЙ ПОДДЕРЖКОЙ
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
+    # Сортировки-псевдонимы из формы и соответствующие им поля
+    order_field = SORT_ALIASES.get(sort_by, sort_by)
+
+    # Режим курсора: без COUNT(*) и OFFSET, только «назад/вперёд»
+    keyset_mode = bool(cursor or request.GET.get('paginate') == 'cursor') and pagination.supports_keyset(order_field)
+
+    filters = catalog.get_filters(request.GET)
+    products = catalog.filter_products(filters, with_rank=sort_by == 'relevance')
+    near_me = catalog.has_location(filters)
+    if near_me:
+        products = catalog.annotate_shop_distance(products, filters)
 
     # Сортировка
-    products = products.order_by(sort_by)
+    if sort_by == 'relevance':
+        products = products.order_by('search_rank', '-created_at') if search_query else products.order_by('-created_at')
+    elif sort_by == 'distance':
+        products = products.order_by('nearest_shop_km', 'id') if near_me else products.order_by('-created_at')
+    elif pagination.supports_keyset(order_field):
+        products = products.order_by(*pagination.keyset_ordering(order_field))
+    else:
+        products = products.order_by(order_field)
 
     # Пагинация
-    paginator = Paginator(products, 6)
-    page_obj = paginator.get_page(page_number)
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    params.pop('page', None)
+    filter_query = params.urlencode()
+    cursor_query = ''
+    if keyset_mode:
+        page_obj = KeysetPaginator(products, order_field, PRODUCTS_PER_PAGE).get_page(cursor)
+        # Оценка считается только если шаблон её выводит
+        result_count = partial(pagination.estimate_count, products)
+        params['paginate'] = 'cursor'
+        cursor_query = params.urlencode()
+    else:
+        paginator = Paginator(products, PRODUCTS_PER_PAGE)
+        page_obj = paginator.get_page(page_number)
+        result_count = paginator.count
 
-    # Данные для фильтров
-    categories = Category.objects.filter(parent__isnull=True)
-    shops = Shop.objects.all()
+    # Данные для фильтров со счётчиками товаров
+    facet_counts = facets.get_facets(filters)
+    categories = hierarchy.get_roots()
+    shops = list(Shop.objects.all())
+    for shop in shops:
+        shop.product_count = facet_counts['shops'].get(shop.id, 0)
 
-    # Избранное
-    user_favorite_ids = []
-    if request.user.is_authenticated:
-        user_favorite_ids = list(Favorite.objects.filter(user=request.user).values_list('product_id', flat=True))
+    # Избранное — из кэша набора id пользователя
+    user_favorite_ids = favorites.get_ids(request.user)
 
     return render(request, 'products/product_list.html', {
         'products': page_obj,
+        'product_cards': cards.render_cards(page_obj, request),
         'search_query': search_query,
         'page_obj': page_obj,
         'categories': categories,
@@ -79,16 +116,26 @@ def product_list(request):
         'price_max': price_max,
         'sort_by': sort_by,
         'user_favorite_ids': user_favorite_ids,
+        'keyset_mode': keyset_mode,
+        'cursor_query': cursor_query,
+        'filter_query': filter_query,
+        'near_me': near_me,
+        'near_lat': filters['lat'],
+        'near_lng': filters['lng'],
+        'near_radius': filters['radius'] or catalog.NEAR_DEFAULT_RADIUS_KM,
+        'result_count': result_count,
+        'category_counts': facet_counts['categories'],
+        'price_ranges': facets.price_ranges(facet_counts['prices']),
     })
 
 
+@anonymous_page_cache(lambda request, product_id: [product_modified_key(product_id)])
 def product_detail(request, product_id):
     product = get_object_or_404(Product, id=product_id, is_active=True)
 
     # Проверяем, добавлен ли товар в избранное для текущего пользователя
-    user_favorites = False
-    if request.user.is_authenticated:
-        user_favorites = Favorite.objects.filter(user=request.user, product=product).exists()
+    user_favorites = product.id in favorites.get_ids(request.user)
+    availability.attach([product])
 
     return render(request, 'products/product_detail.html', {
         'product': product,
@@ -96,6 +143,15 @@ def product_detail(request, product_id):
     })
 
 
+def product_suggest(request):
+    """Подсказки для строки поиска (JSON)"""
+    query = request.GET.get('q', '').strip()[:100]
+    limit = _int_param(request.GET.get('limit'), 8, 1, 20)
+
+    results = suggest.suggest(query, limit) if query else []
+    return JsonResponse({'query': query, 'results': results})
+
+
 @login_required
 @manager_required
 def product_manage(request):
@@ -107,12 +163,20 @@ def product_manage(request):
     total_price = products.aggregate(total=models.Sum('price'))['total'] or 0
 
     return render(request, 'products/manage.html', {
-        'products': products,
+        'products': availability.attach(products.select_related('category')),
         'unique_categories': unique_categories,
         'total_price': total_price
     })
 
 
+def _add_gallery_images(request, product):
+    """Загружает фото галереи из формы и сообщает об отклонённых файлах"""
+    created, errors = gallery.add_images(product, request.FILES.getlist('images'))
+    for filename, reason in errors:
+        messages.warning(request, f'Изображение "{filename}" не загружено: {reason}')
+    return created
+
+
 @login_required
 @manager_required
 def product_add(request):
@@ -125,16 +189,7 @@ def product_add(request):
             product.save()  # Это сохранит все, включая M2M связи!
 
             # Обработка дополнительных изображений
-            additional_images = request.FILES.getlist('images')
-            for i, image_file in enumerate(additional_images[:6]):
-                try:
-                    ProductImage.objects.create(
-                        product=product,
-                        image=image_file,
-                        order=i + 1
-                    )
-                except Exception as e:
-                    print(f"Ошибка при создании изображения {i + 1}: {e}")
+            _add_gallery_images(request, product)
 
             messages.success(request, f'Товар "{product.name}" успешно добавлен!')
             return redirect('product_manage')
@@ -169,19 +224,7 @@ def product_edit(request, product_id):
             product = form.save()  # Это сохранит все, включая M2M!
 
             # Обработка дополнительных изображений
-            additional_images = request.FILES.getlist('images')
-            existing_images_count = product.images.count()
-
-            for i, image_file in enumerate(additional_images):
-                if existing_images_count + i < 6:
-                    try:
-                        ProductImage.objects.create(
-                            product=product,
-                            image=image_file,
-                            order=existing_images_count + i + 1
-                        )
-                    except Exception as e:
-                        messages.warning(request, f'Ошибка при загрузке изображения {i + 1}')
+            _add_gallery_images(request, product)
 
             messages.success(request, f'Товар "{product.name}" успешно обновлен!')
             return redirect('product_manage')
@@ -212,75 +255,182 @@ def product_delete(request, product_id):
     return render(request, 'products/product_confirm_delete.html', {'product': product})
 
 
-@login_required
 def cart_view(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-
-    # Добавляем вычисленные значения в контекст для совместимости
-    cart_items = cart.items.all()
-    total_items = cart.total_items()
-    total_price = cart.total_price()
+    if request.user.is_authenticated:
+        # Страница корзины ничего не записывает: корзина создаётся при первом добавлении
+        cart = Cart.objects.filter(user=request.user).first()
+        # Итоги берутся из полей корзины, строки — одним запросом вместе с товарами
+        cart_items = list(cart.items.select_related('product').order_by('added_at')) if cart else []
+    else:
+        cart = cart_service.AnonymousCart(cart_service.read_anonymous(request))
+        cart_items = cart.lines
 
     context = {
         'cart': cart,
         'cart_items': cart_items,
-        'total_items': total_items,
-        'total_price': total_price
+        'total_items': cart.item_count if cart else 0,
+        'total_price': cart.total_price if cart else 0
     }
 
     return render(request, 'products/cart.html', context)
 
 
-@login_required
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id, is_active=True)
-    cart, created = Cart.objects.get_or_create(user=request.user)
+    product = get_object_or_404(Product.objects.only('id', 'name'), id=product_id, is_active=True)
+    response = redirect('product_detail', product_id=product.id)
 
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': 1}
-    )
-
-    if not created:
-        cart_item.quantity += 1
-        cart_item.save()
+    if request.user.is_authenticated:
+        cart_service.add_item(cart_service.get_cart(request.user), product.id)
+    else:
+        quantities = cart_service.read_anonymous(request)
+        if product.id not in quantities and len(quantities) >= cart_service.MAX_ANONYMOUS_ITEMS:
+            messages.error(request, 'Корзина гостя заполнена — войдите, чтобы добавить больше товаров')
+            return response
+        quantities[product.id] = min(quantities.get(product.id, 0) + 1, cart_service.MAX_QUANTITY)
+        cart_service.save_anonymous(response, quantities)
 
     messages.success(request, f'Товар "{product.name}" добавлен в корзину!')
-    return redirect('product_detail', product_id=product.id)
+    return response
 
 
-@login_required
 def remove_from_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    cart = get_object_or_404(Cart, user=request.user)
+    product = get_object_or_404(Product.objects.only('id', 'name'), id=product_id)
+    response = redirect('cart_view')
 
-    cart_item = get_object_or_404(CartItem, cart=cart, product=product)
-    cart_item.delete()
+    if request.user.is_authenticated:
+        cart = get_object_or_404(Cart, user=request.user)
+        if not cart_service.remove_item(cart, product.id):
+            raise Http404('Товара нет в корзине')
+    else:
+        quantities = cart_service.read_anonymous(request)
+        if quantities.pop(product.id, None) is None:
+            raise Http404('Товара нет в корзине')
+        cart_service.save_anonymous(response, quantities)
 
     messages.success(request, f'Товар "{product.name}" удален из корзины!')
-    return redirect('cart_view')
+    return response
+
+
+@require_POST
+def cart_update(request):
+    """Пакетное изменение корзины (JSON): {"items": [{"product_id": 1, "quantity": 3}, ...]}.
+
+    Количество задаётся абсолютно, 0 удаляет товар из корзины. В ответе — новые итоги.
+    """
+    try:
+        items = json.loads(request.body)['items']
+        quantities = {int(item['product_id']): int(item['quantity']) for item in items}
+    except (ValueError, KeyError, TypeError, OverflowError):
+        return JsonResponse({'error': 'Ожидается {"items": [{"product_id": ..., "quantity": ...}]}'}, status=400)
+
+    if any(not 0 < product_id <= cart_service.MAX_PRODUCT_ID for product_id in quantities):
+        return JsonResponse({'error': 'Некорректный id товара'}, status=400)
+    if len(quantities) > cart_service.MAX_BATCH_ITEMS:
+        return JsonResponse({'error': f'Не больше {cart_service.MAX_BATCH_ITEMS} товаров за раз'}, status=400)
+    if any(quantity < 0 or quantity > cart_service.MAX_QUANTITY for quantity in quantities.values()):
+        return JsonResponse({'error': f'Количество должно быть от 0 до {cart_service.MAX_QUANTITY}'}, status=400)
+
+    # Все добавляемые товары проверяются одним запросом; удалять можно и снятые с продажи
+    added_ids = {product_id for product_id, quantity in quantities.items() if quantity > 0}
+    available = set(Product.objects.filter(id__in=added_ids, is_active=True).values_list('id', flat=True))
+    unknown = sorted(added_ids - available)
+    if unknown:
+        return JsonResponse({'error': 'Товары не найдены', 'unknown_products': unknown}, status=400)
+
+    if request.user.is_authenticated:
+        cart = cart_service.set_quantities(cart_service.get_cart(request.user), quantities)
+        return JsonResponse({
+            'status': 'ok',
+            'item_count': cart.item_count,
+            'total_price': str(cart.total_price),
+        })
+
+    guest_quantities = cart_service.read_anonymous(request)
+    guest_quantities.update(quantities)
+    guest_quantities = {product_id: quantity for product_id, quantity in guest_quantities.items() if quantity > 0}
+    if len(guest_quantities) > cart_service.MAX_ANONYMOUS_ITEMS:
+        return JsonResponse({'error': 'Корзина гостя заполнена — войдите, чтобы добавить больше товаров'}, status=400)
+
+    cart = cart_service.AnonymousCart(guest_quantities)
+    response = JsonResponse({
+        'status': 'ok',
+        'item_count': cart.item_count,
+        'total_price': str(cart.total_price),
+    })
+    cart_service.save_anonymous(response, guest_quantities)
+    return response
 
 
 # Магазины
 def shop_list(request):
     """Список магазинов с картой"""
-    shops = Shop.objects.all()
-    return render(request, 'products/shop_list.html', {'shops': shops})
+    shops = Shop.objects.select_related('owner').order_by('name', 'id')
+    # Список постраничный, карта подгружает маркеры видимой области через shop_map_markers
+    page_obj = Paginator(shops, SHOPS_PER_PAGE).get_page(request.GET.get('page'))
+    return render(request, 'products/shop_list.html', {'shops': page_obj, 'page_obj': page_obj})
 
 
-def nearest_shops(request):
-    """Ближайшие магазины"""
-    user_lat = request.GET.get('lat')
-    user_lng = request.GET.get('lng')
+def shop_map_markers(request):
+    """Маркеры карты магазинов (JSON): кластеры и одиночные магазины в области south, west, north, east"""
+    try:
+        south, west, north, east = (float(request.GET[name]) for name in ('south', 'west', 'north', 'east'))
+        zoom = int(request.GET['zoom'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Нужны параметры south, west, north, east и zoom'}, status=400)
+    if not all(math.isfinite(value) for value in (south, west, north, east)):
+        return JsonResponse({'error': 'Некорректные координаты'}, status=400)
+
+    south, north = max(-90.0, min(south, north)), min(90.0, max(south, north))
+    # Область шире мира показывается целиком
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west, east = (lng if -180 <= lng <= 180 else (lng + 180) % 360 - 180 for lng in (west, east))
+    zoom = min(max(zoom, 0), 22)
+
+    clusters, single_ids = geo.map_markers(south, west, north, east, zoom)
+    shops = Shop.objects.filter(id__in=single_ids[:MAP_MAX_SHOPS]).values(
+        'id', 'name', 'address', 'latitude', 'longitude'
+    )
+    return JsonResponse({
+        'zoom': zoom,
+        'clusters': [{'count': count, 'lat': lat, 'lng': lng} for count, lat, lng in clusters],
+        'shops': [
+            {'id': shop['id'], 'name': shop['name'], 'address': shop['address'],
+             'lat': shop['latitude'], 'lng': shop['longitude']}
+            for shop in shops
+        ],
+        'truncated': len(single_ids) > MAP_MAX_SHOPS,
+    })
 
-    shops = Shop.objects.all()
 
-    if user_lat and user_lng:
-        shops = sorted(shops, key=lambda x: abs(x.latitude - float(user_lat)) + abs(
-            x.longitude - float(user_lng)) if x.latitude and x.longitude else float('inf'))
+def nearest_shops(request):
+    """Ближайшие магазины по расстоянию по поверхности Земли (параметры lat, lng, limit, radius)"""
+    point = geo.parse_point(request.GET.get('lat'), request.GET.get('lng'))
+    limit = _int_param(request.GET.get('limit'), NEAREST_SHOPS_LIMIT, 1, NEAREST_SHOPS_MAX_LIMIT)
+    radius = _float_param(request.GET.get('radius'), None, 0.1, geo.EARTH_RADIUS_KM * math.pi)
+
+    if point:
+        found = geo.nearest_shops(*point, limit=limit, radius_km=radius)
+        shops_by_id = Shop.objects.in_bulk([shop_id for shop_id, distance in found])
+        shops = []
+        for shop_id, distance in found:
+            if shop_id in shops_by_id:
+                shop = shops_by_id[shop_id]
+                shop.distance_km = distance
+                shops.append(shop)
+    else:
+        shops = list(Shop.objects.order_by('name')[:limit])
+
+    return render(request, 'products/nearest_shops.html', {
+        'shops': shops,
+        'located': point is not None,
+        'lat': point[0] if point else '',
+        'lng': point[1] if point else '',
+        'limit': limit,
+        'radius': radius or '',
+    })
 
-    return render(request, 'products/nearest_shops.html', {'shops': shops})
 
 @login_required
 @manager_required
@@ -376,7 +526,8 @@ def shop_delete(request, shop_id):
 @login_required
 def favorite_list(request):
     """Список избранных товаров"""
-    favorites = Favorite.objects.filter(user=request.user).select_related('product')
+    favorites = list(Favorite.objects.filter(user=request.user).select_related('product__category'))
+    availability.attach(favorite.product for favorite in favorites)
     return render(request, 'products/favorite_list.html', {'favorites': favorites})
 
 
@@ -444,4 +595,11 @@ def handler404(request, exception):
 
 
 def handler500(request):
-    return render(request, '500.html', status=500)
\ No newline at end of file
+    return render(request, '500.html', status=500)
+
+
+# Медиафайлы
+@require_safe
+def media_file(request, path):
+    """Раздача загруженных файлов с поддержкой Range и условных запросов"""
+    return media.file_response(request, path)
@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'products.cart.AnonymousCartMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -63,6 +64,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'products.context_processors.cart_count',
             ],
         },
     },
@@ -81,6 +83,27 @@ DATABASES = {
     }
 }
 
+# Общий для всех процессов кэш: по версиям в нём согласованно сбрасываются
+# снимки в памяти процессов (дерево категорий, геоиндекс, подсказки).
+# Таблицы создаются командой createcachetable; в продакшене можно заменить на Redis:
+# 'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'
+CACHES = {
+    # Фрагменты карточек, страницы, наличие в магазинах, избранное
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shoplist_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+    # Версии и метки изменений (products/versioning.py) — отдельно, чтобы вытеснение
+    # фрагментов их не задевало: потеря версии сбрасывает кэши всех процессов.
+    # Ключей здесь порядка числа товаров, поэтому предел фактически не достигается.
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shoplist_cache_versions',
+        'OPTIONS': {'MAX_ENTRIES': 10_000_000},
+    },
+}
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 
@@ -130,7 +153,34 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Изображения товаров хранятся под именами по содержимому: одинаковые файлы — один раз
+STORAGES = {
+    'default': {
+        'BACKEND': 'products.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Отдача медиафайлов веб-сервером (products/media.py): для nginx — префикс internal-локации,
+# указывающей на MEDIA_ROOT (например '/protected-media/'), для Apache/lighttpd — MEDIA_X_SENDFILE = True
+MEDIA_X_ACCEL_REDIRECT = ''
+MEDIA_X_SENDFILE = False
+
 # Создаем необходимые папки при запуске
 os.makedirs(os.path.join(MEDIA_ROOT, 'products', 'main'), exist_ok=True)
 os.makedirs(os.path.join(MEDIA_ROOT, 'products', 'gallery'), exist_ok=True)
-os.makedirs(os.path.join(MEDIA_ROOT, 'shops'), exist_ok=True)
\ No newline at end of file
+os.makedirs(os.path.join(MEDIA_ROOT, 'shops'), exist_ok=True)
+
+# Поиск N+1 запросов в режиме разработки (products/querycount.py).
+# Бюджеты задаются по имени URL; при QUERY_INSPECTOR_STRICT превышение — ошибка (для тестов)
+if DEBUG:
+    MIDDLEWARE.append('products.querycount.QueryInspectorMiddleware')
+
+QUERY_BUDGETS = {
+    'product_list': 15,
+    'product_detail': 10,
+    'product_suggest': 2,
+}
+QUERY_INSPECTOR_STRICT = False
@@ -15,16 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from products.views import media_file
+import re
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('products.urls')),  # Главная страница
     path('users/', include('users.urls')),  # Аутентификация
-]
-
-# Для работы с медиа-файлами в режиме разработки
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # Медиафайлы: Range, ETag, кэширование; в продакшене — через X-Accel-Redirect/X-Sendfile
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media_file, name='media'),
+]
\ No newline at end of file